@@ -1,6 +1,7 @@
 import numpy as np
 
-from backend_algorithms.utils.lidar import PointCloud, count_points, get_pose, get_corners, get_distance
+from backend_algorithms.utils.lidar import pcd_cache, count_points_batch, get_corners_batch, \
+    get_distance_batch, segment_statistics
 from backend_algorithms.utils.general import groupby
 
 
@@ -13,38 +14,23 @@ def cal_instances_info(
             boxes,
             func=lambda x: x["pcdFilePath"]
     ).items():
-        pc_arr = PointCloud(pcd_path).numpy(fields=['x', 'y', 'z'])
-        for obj in cur_boxes:
-            contour = obj['contour']
-            cx, cy, cz = contour['center3D']['x'], contour['center3D']['y'], contour['center3D']['z']
-            dx, dy, dz = contour['size3D']['x'], contour['size3D']['y'], contour['size3D']['z']
-            rx, ry, rz = contour['rotation3D']['x'], contour['rotation3D']['y'], contour['rotation3D']['z']
-            points_n = count_points(
-                pc_arr,
-                cx,
-                cy,
-                cz,
-                dx,
-                dy,
-                dz,
-                rx,
-                ry,
-                rz
-            )
-            corners = get_corners(
-                dx,
-                dy,
-                dz,
-                get_pose(cx, cy, cz, rx, ry, rz)
-            )
-            min_d, max_d = get_distance(corners)
+        pc_arr = pcd_cache.get(pcd_path, fields=['x', 'y', 'z']).numpy(fields=['x', 'y', 'z'])
+        box_arr = np.array([
+            [obj['contour'][k][axis] for k in ('center3D', 'size3D', 'rotation3D') for axis in 'xyz']
+            for obj in cur_boxes
+        ])
+        points_ns = count_points_batch(pc_arr, box_arr)
+        corners = get_corners_batch(box_arr)
+        min_ds, max_ds = get_distance_batch(box_arr, corners)
+        min_hs, max_hs = corners[:, :, 2].min(axis=1), corners[:, :, 2].max(axis=1)
+        for i, obj in enumerate(cur_boxes):
             obj_info = {
                 "objectId": obj['id'],
-                "pointN": points_n,
-                'minDistance': min_d,
-                'maxDistance': max_d,
-                'minHeight': min(corners[:, 2]),
-                'maxHeight': max(corners[:, 2])
+                "pointN": int(points_ns[i]),
+                'minDistance': float(min_ds[i]),
+                'maxDistance': float(max_ds[i]),
+                'minHeight': float(min_hs[i]),
+                'maxHeight': float(max_hs[i])
             }
             results.append(obj_info)
 
@@ -59,25 +45,33 @@ def cal_segments_info(
             segments,
             func=lambda x: (x["pcdFilePath"], x["segmentResultFilePath"])
     ).items():
-        label_pc = PointCloud(seg_path, valid_points=False).data['seg'].reshape(-1, 1)
-        points = PointCloud(pcd_path).numpy(fields=['x', 'y', 'z'])
+        label_pc = pcd_cache.get(seg_path, valid_points=False, fields=['seg']).data['seg']
+        points = pcd_cache.get(pcd_path, fields=['x', 'y', 'z']).numpy(fields=['x', 'y', 'z'])
         if label_pc.shape[0] != points.shape[0]:
             continue
 
-        labeled_pc = np.hstack((points, label_pc))
+        stat = segment_statistics(points, label_pc)
 
         for seg_obj in cur_segments:
-            mask = (labeled_pc[:, -1] == seg_obj['no'])
-            seg_obj_points = labeled_pc[mask]
-            xy_norm = np.linalg.norm(seg_obj_points[:, :2], axis=1)
-            seg_obj_info = {
-                "objectId": seg_obj['id'],
-                "pointN": int(np.sum(mask)),
-                "minDistance": float(min(xy_norm)),
-                "maxDistance": float(max(xy_norm)),
-                "minHeight": float(min(seg_obj_points[:, 2])),
-                "maxHeight": float(max(seg_obj_points[:, 2]))
-            }
+            i = np.searchsorted(stat["id"], seg_obj['no'])
+            if i == len(stat["id"]) or stat["id"][i] != seg_obj['no']:
+                seg_obj_info = {
+                    "objectId": seg_obj['id'],
+                    "pointN": 0,
+                    "minDistance": 0.0,
+                    "maxDistance": 0.0,
+                    "minHeight": 0.0,
+                    "maxHeight": 0.0
+                }
+            else:
+                seg_obj_info = {
+                    "objectId": seg_obj['id'],
+                    "pointN": int(stat["count"][i]),
+                    "minDistance": float(stat["min_distance"][i]),
+                    "maxDistance": float(stat["max_distance"][i]),
+                    "minHeight": float(stat["min_height"][i]),
+                    "maxHeight": float(stat["max_height"][i])
+                }
             results.append(seg_obj_info)
 
     return results
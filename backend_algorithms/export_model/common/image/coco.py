@@ -1,13 +1,16 @@
+import os
 import time
-import json
 from pathlib import Path
+from typing import Dict, List, Iterator
 
 import numpy as np
 from shapely.geometry import Polygon, MultiPolygon
 from loguru import logger
 
 from backend_algorithms.utils.image import find_diagonal
+from backend_algorithms.utils import json_codec
 from backend_algorithms.utils.general import groupby
+from backend_algorithms.export_model.export_utils.export_manifest import ExportManifest
 
 
 def to_array_points(
@@ -72,6 +75,182 @@ class OntoParser:
             self.onto[k]['id'] = i + 1
 
 
+class CocoWriter:
+    """ Write a COCO json document incrementally: categories up front, then images, then annotations.
+
+    Ids are assigned on write, counting on from ``img_id``/``ann_id``; all images of the
+    document have to be written before its first annotation. The document goes to a temporary
+    file that only replaces ``file`` once it is complete.
+    """
+
+    def __init__(
+            self,
+            file: Path,
+            categories: List[Dict],
+            img_id: int = 1,
+            ann_id: int = 1
+    ):
+        self.file = Path(file)
+        self.categories = categories
+        self.img_id = img_id
+        self.ann_id = ann_id
+
+        self._f = None
+        self._section = None
+        self._first = True
+
+    def __enter__(
+            self
+    ):
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self._tmp_file.open('wb')
+        self._f.write(b'{"info":{},"licenses":[],"categories":')
+        self._f.write(json_codec.dumps(self.categories))
+        self._start('images')
+
+        return self
+
+    def __exit__(
+            self,
+            exc_type,
+            exc_val,
+            exc_tb
+    ):
+        try:
+            with self._f:
+                if exc_type is None:
+                    self._start('annotations')
+                    self._f.write(b']}')
+            if exc_type is None:
+                os.replace(self._tmp_file, self.file)
+        finally:
+            self._f = None
+            self._tmp_file.unlink(missing_ok=True)
+
+    @property
+    def _tmp_file(
+            self
+    ) -> Path:
+        return self.file.with_name(f'.{self.file.name}.tmp')
+
+    def _start(
+            self,
+            section: str
+    ):
+        if self._section == section:
+            return
+        if section == 'images' and self._section is not None:
+            raise RuntimeError('coco images must be written before annotations')
+
+        self._f.write((b']' if self._section else b'') + f',"{section}":['.encode('utf-8'))
+        self._section = section
+        self._first = True
+
+    def _write(
+            self,
+            section: str,
+            item: Dict
+    ):
+        self._start(section)
+        if not self._first:
+            self._f.write(b',')
+        self._f.write(json_codec.dumps(item))
+        self._first = False
+
+    def add_image(
+            self,
+            image: Dict
+    ) -> int:
+        image['id'] = img_id = self.img_id
+        self._write('images', image)
+        self.img_id += 1
+
+        return img_id
+
+    def add_annotation(
+            self,
+            ann: Dict
+    ) -> int:
+        ann['id'] = ann_id = self.ann_id
+        self._write('annotations', ann)
+        self.ann_id += 1
+
+        return ann_id
+
+
+def iter_annotations(
+        ann_dict: List[Dict],
+        img_id: int,
+        op: OntoParser
+) -> Iterator[Dict]:
+    # 整合多个resource的标注
+    total_anns = []
+    for single_source in ann_dict:
+        total_anns.extend(single_source['instances'])
+
+    # 改单个格式
+    # 区分框/多边形、骨骼点
+    box_instances = [x for x in total_anns if x['type'] in ["BOUNDING_BOX", "RECTANGLE"]]
+    others_instances = [x for x in total_anns if x['type'] in ['POLYGON', 'SKELETON']]
+
+    # 框单独导
+    for box_inst in box_instances:
+        # 获取类别
+        cur_class_name = box_inst['className'] or box_inst['modelClass']
+        xmin, ymin, w, h = find_diagonal(
+            box_inst['contour']['points'],
+            return_w_h=True
+        )
+
+        yield {
+            "area": box_inst['contour'].get('area') or (round(w * h)),
+            "image_id": img_id,
+            "bbox": [xmin, ymin, w, h],
+            "iscrowd": 0,
+            "segmentation": [],
+            "category_id": op.onto.get(cur_class_name, {'id': -1})['id']
+        }
+
+    # 将同组结果聚合, 没编组的自己一组
+    group_dict = groupby(others_instances, lambda x: x['groups'][0] if x['groups'] else x['id'])
+
+    for gid, instances in group_dict.items():
+        # 获取类别
+        cur_class_name = instances[0]['className'] or instances[0]['modelClass']
+
+        # 区分polygon和skeleton
+        polygons = [to_array_points(x['contour']['points']) for x in instances if x['type'] == 'POLYGON']
+        skeleton = ([x for x in instances if x['type'] == 'SKELETON'] + [{}])[0]
+
+        # 创建MultiPolygon
+        mp = MultiPolygon([Polygon(x) for x in polygons])
+        xmin, ymin, xmax, ymax = mp.bounds
+
+        cur_coco_ann = {
+            "segmentation": [x.flatten().tolist() for x in polygons],
+            "area": mp.area,
+            "iscrowd": 0,
+            "image_id": img_id,
+            "bbox": [xmin, ymin, xmax - xmin, ymax - ymin],
+            "category_id": op.onto.get(cur_class_name, {'id': -1})['id']
+        }
+
+        # 加Keypoints字段进去
+        if skeleton:
+            sk = skeleton
+            cur_coco_ann['num_keypoints'] = len([x for x in sk['contour']['nodes'] if x['attr']['valid']])
+            cur_coco_ann['keypoints'] = []
+            for n in skeleton['contour']['nodes']:
+                try:
+                    cur_nodes = [n['position']['x'], n['position']['y'], int(n['attr']['code'])]
+                except ValueError:
+                    raise ValueError('skeleton node attribute are numbers like 1 or "1"')
+
+                cur_coco_ann['keypoints'] += cur_nodes
+
+        yield cur_coco_ann
+
+
 def trans(input_json):
     code = 'OK'
     message = ''
@@ -94,7 +273,7 @@ def trans(input_json):
         return code, message
 
     # 读取所有result json, 按result的上一级分开存放
-    total_files = origin_path.rglob('*.json')
+    total_files = ExportManifest(origin_path).iter_files(suffix='.json')
     files_map = groupby(total_files, lambda x: x.parent.name)
     result_map = {}
     for k, v in files_map.items():
@@ -110,134 +289,46 @@ def trans(input_json):
 
     # 导出
     for folder, files in result_map['result'].items():
-        # 当前结果框架
-        cur_result = {
-            'info': {},
-            'licenses': [],
-            'images': [],
-            'annotations': [],
-            'categories': list(op.onto.values())
-        }
-
-        # images字段
-        datas = result_map['data'][folder]
-        # 记录当前json里的图片id
-        img_id_map = {}
-        for d in datas:
-            meta_data = json.load(d.open(encoding='utf-8'))['images'][0]
-            file_name = meta_data['filename']
-
-            cur_img_data = {
-                "file_name": file_name,
-                "height": meta_data['height'],
-                "width": meta_data['width'],
-                "id": img_id
-            }
-            cur_result['images'].append(cur_img_data)
-
-            # 记录图片编号
-            img_id_map[d.stem] = img_id
-            img_id += 1
-
-            if has_origin_file:
-                img_path = d.parent.parent / file_name
-                if not img_path.exists():
-                    img_path = d.parent.parent / 'image_0' / file_name
-
-                img_output = target_path / folder.relative_to(origin_path) / 'images' / img_path.name
-                img_output.parent.mkdir(parents=True, exist_ok=True)
-                img_path.replace(img_output)
-
-            logger.info(f'time(s): {time.time() - start_time:.3f}; '
-                        f'script: export_model/common/image/coco; '
-                        f'info: parse data {d} finished')
-
-        # annotations字段
-        for file in files:
-            # 对应回原数据
-            img_id = img_id_map[file.stem]
-
-            ann_dict = json.load(file.open(encoding='utf-8'))
-
-            # 整合多个resource的标注
-            total_anns = []
-            for single_source in ann_dict:
-                total_anns.extend(single_source['instances'])
-
-            # 改单个格式
-            # 区分框/多边形、骨骼点
-            box_instances = [x for x in total_anns if x['type'] in ["BOUNDING_BOX", "RECTANGLE"]]
-            others_instances = [x for x in total_anns if x['type'] in ['POLYGON', 'SKELETON']]
-
-            # 框单独导
-            for box_inst in box_instances:
-                # 获取类别
-                cur_class_name = box_inst['className'] or box_inst['modelClass']
-                xmin, ymin, w, h = find_diagonal(
-                    box_inst['contour']['points'],
-                    return_w_h=True
-                )
-
-                cur_coco_ann = {
-                    "area": box_inst['contour'].get('area') or (round(w * h)),
-                    "image_id": img_id,
-                    "bbox": [xmin, ymin, w, h],
-                    "iscrowd": 0,
-                    "segmentation": [],
-                    "category_id": op.onto.get(cur_class_name, {'id': -1})['id'],
-                    "id": ann_id
-                }
-
-                cur_result['annotations'].append(cur_coco_ann)
-                ann_id += 1
-
-            # 将同组结果聚合, 没编组的自己一组
-            group_dict = groupby(others_instances, lambda x: x['groups'][0] if x['groups'] else x['id'])
-
-            for gid, instances in group_dict.items():
-                # 获取类别
-                cur_class_name = instances[0]['className'] or instances[0]['modelClass']
-
-                # 区分polygon和skeleton
-                polygons = [to_array_points(x['contour']['points']) for x in instances if x['type'] == 'POLYGON']
-                skeleton = ([x for x in instances if x['type'] == 'SKELETON'] + [{}])[0]
-
-                # 创建MultiPolygon
-                mp = MultiPolygon([Polygon(x) for x in polygons])
-                xmin, ymin, xmax, ymax = mp.bounds
-
-                cur_coco_ann = {
-                    "segmentation": [x.flatten().tolist() for x in polygons],
-                    "area": mp.area,
-                    "iscrowd": 0,
-                    "image_id": img_id,
-                    "bbox": [xmin, ymin, xmax - xmin, ymax - ymin],
-                    "category_id": op.onto.get(cur_class_name, {'id': -1})['id'],
-                    "id": ann_id
-                }
-
-                # 加Keypoints字段进去
-                if skeleton:
-                    sk = skeleton
-                    cur_coco_ann['num_keypoints'] = len([x for x in sk['contour']['nodes'] if x['attr']['valid']])
-                    cur_coco_ann['keypoints'] = []
-                    for n in skeleton['contour']['nodes']:
-                        try:
-                            cur_nodes = [n['position']['x'], n['position']['y'], int(n['attr']['code'])]
-                        except ValueError:
-                            raise ValueError('skeleton node attribute are numbers like 1 or "1"')
-
-                        cur_coco_ann['keypoints'] += cur_nodes
-
-                cur_result['annotations'].append(cur_coco_ann)
-                ann_id += 1
-
-            logger.info(f'time(s): {time.time() - start_time:.3f}; '
-                        f'script: export_model/common/image/coco; '
-                        f'info: parse annotation {file} finished')
-
         coco_output = target_path / folder.relative_to(origin_path) / (folder.name + '.json')
-        coco_output.parent.mkdir(parents=True, exist_ok=True)
-        json.dump(cur_result, coco_output.open('w', encoding='utf-8'), ensure_ascii=False)
+        with CocoWriter(coco_output, list(op.onto.values()), img_id, ann_id) as writer:
+            # images字段
+            datas = result_map['data'][folder]
+            # 记录当前json里的图片id
+            img_id_map = {}
+            for d in datas:
+                meta_data = json_codec.load_file(d)['images'][0]
+                file_name = meta_data['filename']
+
+                # 记录图片编号
+                img_id_map[d.stem] = writer.add_image({
+                    "file_name": file_name,
+                    "height": meta_data['height'],
+                    "width": meta_data['width']
+                })
+
+                if has_origin_file:
+                    img_path = d.parent.parent / file_name
+                    if not img_path.exists():
+                        img_path = d.parent.parent / 'image_0' / file_name
+
+                    img_output = target_path / folder.relative_to(origin_path) / 'images' / img_path.name
+                    img_output.parent.mkdir(parents=True, exist_ok=True)
+                    img_path.replace(img_output)
+
+                logger.info(f'time(s): {time.time() - start_time:.3f}; '
+                            f'script: export_model/common/image/coco; '
+                            f'info: parse data {d} finished')
+
+            # annotations字段, 逐帧写出, 不保留整帧结果
+            for file in files:
+                # 对应回原数据
+                for cur_coco_ann in iter_annotations(json_codec.load_file(file), img_id_map[file.stem], op):
+                    writer.add_annotation(cur_coco_ann)
+
+                logger.info(f'time(s): {time.time() - start_time:.3f}; '
+                            f'script: export_model/common/image/coco; '
+                            f'info: parse annotation {file} finished')
+
+        img_id, ann_id = writer.img_id, writer.ann_id
 
     return code, message
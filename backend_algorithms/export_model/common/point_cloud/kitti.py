@@ -1,10 +1,11 @@
-import requests
 import numpy as np
 import os
 from os.path import *
 import json
 
-from backend_algorithms.utils.lidar import alpha_in_pi
+from backend_algorithms.utils.lidar import project_boxes_to_cameras
+from backend_algorithms.utils.fetch import prefetch
+from backend_algorithms.utils.camera_config import camera_config_cache
 
 
 def load_json(json_path: str):
@@ -34,15 +35,35 @@ def list_data_files(in_path: str, match):
     return file_list
 
 
-def gen_alpha(rz, ext_matrix, lidar_center):
-    lidar_center = np.hstack((lidar_center, np.array([1])))
-    cam_point = ext_matrix @ np.array([np.cos(rz), np.sin(rz), 0, 1])
-    cam_point_0 = ext_matrix @ np.array([0, 0, 0, 1])
-    ry = -1 * (alpha_in_pi(np.arctan2(cam_point[2] - cam_point_0[2], cam_point[0] - cam_point_0[0])))
-    cam_center = ext_matrix @ lidar_center.T
-    theta = alpha_in_pi(np.arctan2(cam_center[0], cam_center[2]))
-    alpha = ry - theta
-    return ry, alpha
+def iter_results(in_path: str, has_origin_file):
+    """ Result files with their instances and data content, each json read once. """
+    for result_file in list_result_files(in_path, '.json'):
+        instances = []
+        for result in load_json(result_file):
+            instances.extend(result['instances'])
+        data_content = None
+        if instances and not has_origin_file:
+            data_content = load_json(join(dirname(dirname(result_file)), 'data', basename(result_file)))
+        yield result_file, instances, data_content
+
+
+def submit_camera_config(frame):
+    data_content = frame[2] or {}
+    camera_config_cache.submit((data_content.get('cameraConfig') or {}).get('url'))
+
+
+def project_3d_boxes(obj_3d, cam_param, cam_indices):
+    """ Project the 3D boxes into the cameras in ``cam_indices`` only, other cameras are not read. """
+    box_index = {track_id: k for k, track_id in enumerate(obj_3d)}
+    cam_row = {cam_index: j for j, cam_index in enumerate(cam_indices)}
+    contours = [x['contour'] for x in obj_3d.values()]
+    centers = np.array([list(c['center3D'].values()) for c in contours], dtype=np.float64).reshape(-1, 3)
+    heights = np.array([c['size3D']['z'] for c in contours], dtype=np.float64)
+    rz = np.array([c['rotation3D']['z'] for c in contours], dtype=np.float64)
+    ext_matrices = np.array(
+        [cam_param[i]['camera_external'] for i in cam_row], dtype=np.float64
+    ).reshape(-1, 4, 4)
+    return box_index, cam_row, project_boxes_to_cameras(ext_matrices, centers, heights, rz)
 
 
 def find_attr(data_list, target_key):
@@ -62,33 +83,31 @@ def trans(input_json):
     has_origin_file = input_json.get('hasOriginFile')
     origin_path = input_json.get('originPath')
     target_path = input_json.get('targetPath')
-    for result_file in list_result_files(origin_path, '.json'):
+    # 相机参数在读到后续帧时提前后台下载
+    frames = prefetch(iter_results(origin_path, has_origin_file), submit_camera_config, ahead=8)
+    for result_file, instances, data_content in frames:
         result_txt_path = dirname(result_file.replace(origin_path, target_path))
-        result_contents = load_json(result_file)
-        instances = []
-        for result in result_contents:
-            instances.extend(result['instances'])
 
         if instances:
             if has_origin_file:
                 pass  # 点云融合项目暂时不支持导出原文件
             else:
-                data_file = join(dirname(dirname(result_file)), 'data', basename(result_file))
-                data_content = load_json(data_file)
                 config_url = data_content.get('cameraConfig')
                 if not config_url:
                     error = f"The data named '{basename(result_file)}' lacks a camera parameter file and cannot be exported to kitti format"
                     errors.append(error)
                     continue
                 else:
-                    print(config_url['url'])
-                    cam_param = requests.get(config_url['url']).json()
+                    cam_param = camera_config_cache.get(config_url['url'])
                     obj_rect = {f"{x['trackId']}-{x['contour']['viewIndex']}": x for x in instances if
                                 x['type'] == '2D_RECT'}
                     obj_3d = {x['trackId']: x for x in instances if x['type'] == '3D_BOX'}
+                    # 只投影有3D框对应2D框的相机
+                    cam_indices = sorted({x['contour']['viewIndex'] for x in obj_rect.values() if x['trackId'] in obj_3d})
+                    box_index, cam_row, (cam_xyz, cam_ry, cam_alpha) = project_3d_boxes(obj_3d, cam_param, cam_indices)
+                    label_lines = {}
                     for rect in obj_rect.values():
                         cam_index = rect['contour']['viewIndex']
-                        ext_matrix = np.array(cam_param[cam_index]['camera_external']).reshape(4, 4)
                         label = rect['className']
                         if not label:
                             label = 'noclass'
@@ -106,13 +125,10 @@ def trans(input_json):
                         if rect['trackId'] in obj_3d.keys():
                             contour_3d = obj_3d[rect['trackId']]['contour']
                             length, width, height = contour_3d['size3D'].values()
-                            cur_rz = contour_3d['rotation3D']['z']
-
-                            ry, alpha = gen_alpha(cur_rz, ext_matrix, np.array(list(contour_3d['center3D'].values())))
-
-                            point = list(contour_3d['center3D'].values())
-                            temp = np.hstack((np.array([point[0], point[1], point[2] - height / 2]), np.array([1])))
-                            x, y, z = list((ext_matrix @ temp))[:3]
+                            k = box_index[rect['trackId']]
+                            j = cam_row[cam_index]
+                            ry, alpha = cam_ry[j, k], cam_alpha[j, k]
+                            x, y, z = cam_xyz[j, k]
                             score = 1
                             string = f"{label} {truncated:.2f} {occluded} {alpha:.2f} " \
                                      f"{min(x_list):.2f} {min(y_list):.2f} {max(x_list):.2f} {max(y_list):.2f} " \
@@ -122,12 +138,14 @@ def trans(input_json):
                             string = f"DontCare -1 -1 -10 " \
                                      f"{min(x_list):.2f} {min(y_list):.2f} {max(x_list):.2f} {max(y_list):.2f} " \
                                      f"-1 -1 -1 -1000 -1000 -1000 -10\n"
+                        label_lines.setdefault(cam_index, []).append(string)
 
+                    for cam_index, lines in label_lines.items():
                         result_txt_file = join(result_txt_path, f"label_{cam_index}",
                                                splitext(basename(result_file))[0] + '.txt')
                         ensure_dir(dirname(result_txt_file))
                         with open(result_txt_file, 'a+', encoding='utf-8') as tf:
-                            tf.write(string)
+                            tf.write(''.join(lines))
         else:
             continue
     if errors:
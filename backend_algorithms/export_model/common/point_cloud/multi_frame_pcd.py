@@ -0,0 +1,16 @@
+from backend_algorithms.export_model import Lidar4DExportExecutor
+from backend_algorithms.utils.lidar import PointCloud
+
+
+def trans(input_json):
+    exe = Lidar4DExportExecutor(input_json)
+    window = input_json.get('frameWindow') or 5
+
+    for single_data, aggregator in exe.iter_aggregated(window=window):
+        output_path = single_data.prepare_path(exe.target_path, '.pcd')
+        if exe.pcd_preprocess:
+            merged = PointCloud(None, valid_points=False)
+            merged.data = aggregator.merged()
+            PointCloud.save_pcd(exe.preprocess_pcd(merged).data, output_path)
+        else:
+            aggregator.write(output_path)
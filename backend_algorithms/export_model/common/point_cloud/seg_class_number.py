@@ -1,7 +1,7 @@
-import pandas as pd
+import numpy as np
 
 from backend_algorithms.export_model import Lidar3DExportExecutor
-from backend_algorithms.utils.lidar import PointCloud
+from backend_algorithms.utils.lidar import PointCloud, remap_labels
 
 
 def trans(input_json):
@@ -10,8 +10,14 @@ def trans(input_json):
     id_number_map = exe.ontology_info.id_number_map
 
     for single_data in exe.iter_dataset():
-        no_number_map = {x.no: id_number_map[x.class_id] for x in single_data.get_results().segments}
-        seg_df = pd.DataFrame(single_data.get_results().segmentation.data).applymap(lambda no: no_number_map.get(no, 0))
+        results = single_data.get_results()
+        no_number_map = {x.no: id_number_map[x.class_id] for x in results.segments}
+
+        seg = results.segmentation.data
+        output = np.empty(len(seg), dtype=[(name, np.int64) for name in seg.dtype.names])
+        for name in seg.dtype.names:
+            output[name] = remap_labels(seg[name], no_number_map, default=0, dtype=np.int64)
+
         PointCloud.save_pcd(
-            seg_df.to_records(index=False), exe.target_path / single_data.segmentation_file.relative_to(exe.origin_path)
+            output, exe.target_path / single_data.segmentation_file.relative_to(exe.origin_path)
         )
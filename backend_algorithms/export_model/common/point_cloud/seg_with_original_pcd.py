@@ -1,22 +1,29 @@
 import numpy as np
-import pandas as pd
 
 from backend_algorithms.export_model import Lidar3DExportExecutor
+from backend_algorithms.utils.lidar import PointCloud
 
 
 def trans(input_json):
     exe = Lidar3DExportExecutor(input_json)
     exe.copy_export_files()
 
-    for single_data in exe.iter_dataset():
-        pc = single_data.get_org_pcd()
-        pc_df = pd.DataFrame(pc.data)
+    for single_data in exe.iter_dataset(prefetch='org_pcd'):
+        # 分割结果与原始点一一对应, 无效点需从点云和分割结果中一起去掉
+        pc = single_data.get_org_pcd(valid_points=False)
         if single_data.segmentation_file:
-            pc_df["seg"] = pd.DataFrame(single_data.get_results().segmentation.data)["seg"]
+            seg = single_data.get_results().segmentation.data["seg"].astype(np.int32, copy=False)
         else:
-            pc_df["seg"] = 0
-        pc_df["seg"] = pc_df["seg"].astype(np.int32)
-        pc.save_pcd(
-            pc_df.to_records(index=False),
-            exe.target_path / single_data.segmentation_file.relative_to(exe.origin_path)
-        )
+            seg = np.int32(0)
+
+        mask = pc.valid_mask()
+        if not mask.all():
+            pc.data = pc.data[mask]
+            if seg.ndim:
+                seg = seg[mask]
+
+        output_path = exe.target_path / single_data.segmentation_file.relative_to(exe.origin_path)
+        if exe.pcd_preprocess:
+            PointCloud.save_pcd(exe.preprocess_pcd(pc.with_columns({"seg": seg})).data, output_path)
+        else:
+            PointCloud.save_pcd_with_columns(pc.data, {"seg": seg}, output_path)
@@ -1,21 +1,42 @@
-import json
 import time
+from functools import wraps, cached_property
 from io import BytesIO
 from base64 import b64encode
 from pathlib import Path
 from xml.dom.minidom import Document
 from abc import abstractmethod
+from concurrent.futures import Future
 from typing import Union, Optional, List, Dict
 
 import pandas as pd
-import requests
 from PIL import Image
 from loguru import logger
 
 from backend_algorithms.export_model.export_utils.external_result import ExternalResult, ExternalImageResult, \
     ExternalLidarResult, ExternalAVResult, ExternalTextResult
+from backend_algorithms.utils import json_codec
 from backend_algorithms.utils.general import filter_parts
 from backend_algorithms.utils.lidar import PointCloud
+from backend_algorithms.utils.camera_config import camera_config_cache
+from backend_algorithms.utils.fetch import fetcher
+
+
+def memoize_results(
+        func
+):
+    """ Cache ``get_results`` per instance and source_type; results are shared, not copied. """
+
+    @wraps(func)
+    def wrapper(
+            self,
+            source_type: Optional[Union[str, List]] = None
+    ):
+        key = tuple(source_type) if isinstance(source_type, list) else source_type
+        if key not in self._results:
+            self._results[key] = func(self, source_type)
+        return self._results[key]
+
+    return wrapper
 
 
 class ExportData:
@@ -25,21 +46,47 @@ class ExportData:
             **kwargs
     ):
         self.meta_path: Path = Path(meta_path)
-        self.meta: Dict = json.load(self.meta_path.open(encoding='utf-8'))
-        self.data_id: int = self.meta['dataId']
-        self.name: str = self.meta['name']
-        self.org_path: Path = Path(self.name)
-
         self.result_path = self.meta_path.parent.parent / 'result' / self.meta_path.name
 
-        self._logger = kwargs.get("logger", True)
         self._no = kwargs.get("no", -1)
         self._script = kwargs.get("script", "unknown")
         self._start_time = kwargs.get("start_time", 0)
         self._add_info = kwargs.get("add_info", '')
+        self._manifest = kwargs.get("manifest")
+        self._prefetched: Dict[str, Future] = {}
+        self._results: Dict = {}
+
+    @cached_property
+    def meta(
+            self
+    ) -> Dict:
+        return json_codec.load_file(self.meta_path)
 
-        if self._logger:
-            self.log_self()
+    @cached_property
+    def data_id(
+            self
+    ) -> int:
+        return self.meta['dataId']
+
+    @cached_property
+    def name(
+            self
+    ) -> str:
+        return self.meta['name']
+
+    @cached_property
+    def org_path(
+            self
+    ) -> Path:
+        return Path(self.name)
+
+    @cached_property
+    def _result_list(
+            self
+    ) -> List:
+        if not self._exists(self.result_path):
+            return []
+        return json_codec.load_file(self.result_path)
 
     def __str__(
             self
@@ -56,6 +103,7 @@ class ExportData:
             add_info: Optional[str] = None,
             no: Optional[int] = None
     ):
+        """ Log progress by meta path, so logging neither reads nor depends on the meta file. """
         if no is None:
             no = self._no
 
@@ -63,20 +111,28 @@ class ExportData:
             f'time(s): {time.time() - self._start_time:.3f}; '
             f'script: {self._script}; '
             f'no: {no}; '
-            f'data_id: {self.data_id}; '
+            f'meta: {self.meta_path}; '
             f'add_info: {self._add_info if add_info is None else add_info}'
         )
 
+    def _exists(
+            self,
+            path: Path
+    ) -> bool:
+        if self._manifest is not None:
+            return self._manifest.exists(path)
+        return path.exists()
+
     def _find_file(
             self,
             folder_name
     ):
         file_path = self.meta_path.parent.parent / self.org_path.name
-        if file_path.exists():
+        if self._exists(file_path):
             return file_path
 
         file_path = file_path.parent / folder_name / file_path.name
-        if file_path.exists():
+        if self._exists(file_path):
             return file_path
 
     def prepare_path(
@@ -109,7 +165,7 @@ class ExportData:
                 "ensure_ascii": False,
                 **add_params
             }
-            result = json.dumps(result, **json_params)
+            result = json_codec.dumps(result, **json_params)
 
         elif isinstance(result, Document):
             result = result.toprettyxml()
@@ -133,10 +189,45 @@ class ExportData:
 
         raise ValueError('unexpected result type')
 
+    def _asset_urls(
+            self
+    ) -> Dict[str, str]:
+        return {
+            'meta': (self.meta.get('meta') or {}).get('url')
+        }
+
+    def prefetch(
+            self,
+            *assets: str
+    ):
+        """
+        Start downloading remote assets in the background, all of them if none are named.
+        """
+        try:
+            urls = self._asset_urls()
+        except Exception as e:
+            # meta读不了时不预取, 转换该帧时再报错
+            logger.warning(f"{self.meta_path}: prefetch skipped, {e!r}")
+            return
+
+        for name, url in urls.items():
+            if url and (not assets or name in assets) and name not in self._prefetched:
+                self._prefetched[name] = fetcher.submit(url)
+
+    def _fetch(
+            self,
+            name: str
+    ):
+        future = self._prefetched.pop(name, None)
+        if future is not None:
+            return future.result()
+
+        return fetcher.get(self._asset_urls()[name])
+
     def get_meta(
             self
     ):
-        return requests.get(url=self.meta["meta"]["url"]).text
+        return self._fetch('meta').text
 
     @abstractmethod
     def get_results(
@@ -152,43 +243,56 @@ class ExportData:
 
 
 class ExportImageData(ExportData):
-    def __init__(
-            self,
-            meta_path: Union[str, Path],
-            **kwargs
-    ):
-        super().__init__(
-            meta_path=meta_path,
-            **kwargs
-        )
+    @cached_property
+    def _info(
+            self
+    ) -> Dict:
+        return self.meta['images'][0]
 
-        self._info = self.meta['images'][0]
-        self.iw: int = self._info['width']
-        self.ih: int = self._info['height']
-        self.org_path: Path = Path(self._info['zipPath'] or self._info['filename'])
+    @cached_property
+    def iw(
+            self
+    ) -> int:
+        return self._info['width']
 
-        self.file: Optional[Path] = self._find_file(folder_name="image_0")
+    @cached_property
+    def ih(
+            self
+    ) -> int:
+        return self._info['height']
 
-        self.segmentation_file: Optional[Path] = self._find_segmentation_file()
+    @cached_property
+    def org_path(
+            self
+    ) -> Path:
+        return Path(self._info['zipPath'] or self._info['filename'])
+
+    @cached_property
+    def file(
+            self
+    ) -> Optional[Path]:
+        return self._find_file(folder_name="image_0")
+
+    @cached_property
+    def segmentation_file(
+            self
+    ) -> Optional[Path]:
+        return self._find_segmentation_file()
 
     def _find_segmentation_file(
             self
     ):
         seg_path = self.result_path.parent / f'{self.name}_image_0_segmentation.png'
-        if seg_path.exists():
+        if self._exists(seg_path):
             return seg_path
 
+    @memoize_results
     def get_results(
             self,
             source_type: Optional[Union[str, List]] = None
     ) -> ExternalImageResult:
-        if not self.result_path.exists():
-            result = []
-        else:
-            result = json.load(self.result_path.open(encoding='utf-8'))
-
         return ExternalImageResult(
-            result_list=result,
+            result_list=self._result_list,
             source_type=source_type
         )
 
@@ -225,65 +329,74 @@ class ExportImageData(ExportData):
 
 
 class Export3DLidarData(ExportData):
-    def __init__(
-            self,
-            meta_path: Union[str, Path],
-            **kwargs
-    ):
-        super().__init__(
-            meta_path=meta_path,
-            **kwargs
-        )
+    @cached_property
+    def _info(
+            self
+    ) -> Dict:
+        return self.meta['lidarPointClouds'][0]
 
-        self._info = self.meta['lidarPointClouds'][0]
-        self.org_path: Path = Path(self._info['zipPath'] or self._info['filename'])
+    @cached_property
+    def org_path(
+            self
+    ) -> Path:
+        return Path(self._info['zipPath'] or self._info['filename'])
 
-        self.segmentation_file: Optional[Path] = self._find_segmentation_file()
+    @cached_property
+    def segmentation_file(
+            self
+    ) -> Optional[Path]:
+        return self._find_segmentation_file()
 
     def _find_segmentation_file(
             self
     ):
         seg_path = self.result_path.parent / f'{self.name}_lidar_point_cloud_0_segmentation.pcd'
-        if seg_path.exists():
+        if self._exists(seg_path):
             return seg_path
 
     def _load_segmentation(
             self
     ):
-        return PointCloud(self._find_segmentation_file(), valid_points=False)
+        return PointCloud.open(self.segmentation_file, mmap=True, valid_points=False)
 
+    @memoize_results
     def get_results(
             self,
             source_type: Optional[Union[str, List]] = None
     ) -> ExternalLidarResult:
-        if not self.result_path.exists():
-            result = []
-        else:
-            result = json.load(self.result_path.open(encoding='utf-8'))
-
         return ExternalLidarResult(
-            result_list=result,
+            result_list=self._result_list,
             source_type=source_type,
-            segmentation=self._load_segmentation()
+            segmentation=self._load_segmentation
         )
 
+    def _asset_urls(
+            self
+    ) -> Dict[str, str]:
+        return {
+            **super()._asset_urls(),
+            'bin_pcd': self._info.get('binaryUrl'),
+            'org_pcd': self._info.get('url')
+        }
+
     def get_bin_pcd(
             self
     ) -> PointCloud:
 
-        return PointCloud(BytesIO(requests.get(self._info.get('binaryUrl')).content))
+        return PointCloud(BytesIO(self._fetch('bin_pcd').content))
 
     def get_org_pcd(
             self,
+            valid_points: bool = True
     ) -> PointCloud:
 
-        return PointCloud(BytesIO(requests.get(self._info.get('url')).content))
+        return PointCloud(BytesIO(self._fetch('org_pcd').content), valid_points=valid_points)
 
     def get_camera_config(
             self
     ) -> Optional[List]:
 
-        return requests.get((self.meta.get('cameraConfig') or {}).get('url')).json()
+        return camera_config_cache.get((self.meta.get('cameraConfig') or {}).get('url'))
 
 
 class Export4DLidarData(Export3DLidarData):
@@ -291,66 +404,83 @@ class Export4DLidarData(Export3DLidarData):
             self
     ):
         seg_path = self.result_path.parent / f'{self.name}_lidar_point_cloud_segmentation.pcd'
-        if seg_path.exists():
+        if self._exists(seg_path):
             return seg_path
 
+    def _asset_urls(
+            self
+    ) -> Dict[str, str]:
+        return {
+            **super()._asset_urls(),
+            'ego_config': (self.meta.get('egoVehicleConfig') or {}).get('url')
+        }
+
+    def get_ego_config(
+            self
+    ) -> Optional[Dict]:
+        config_file = self.meta_path.parent.parent / 'ego_vehicle_config' / self.meta_path.name
+        if self._exists(config_file):
+            return json_codec.load_file(config_file)
+
+        if self._asset_urls()['ego_config']:
+            return self._fetch('ego_config').json()
+
 
 class ExportAVData(ExportData):
-    def __init__(
-            self,
-            meta_path: Union[str, Path],
-            **kwargs
-    ):
-        super().__init__(
-            meta_path=meta_path,
-            **kwargs
-        )
+    @cached_property
+    def _info(
+            self
+    ) -> Dict:
+        return self.meta['avs'][0]
 
-        self._info = self.meta['avs'][0]
-        self.duration: float = self._info['duration'] or 0.0
-        self.org_path: Path = Path(self._info['zipPath'] or self._info['filename'])
+    @cached_property
+    def duration(
+            self
+    ) -> float:
+        return self._info['duration'] or 0.0
 
+    @cached_property
+    def org_path(
+            self
+    ) -> Path:
+        return Path(self._info['zipPath'] or self._info['filename'])
+
+    @memoize_results
     def get_results(
             self,
             source_type: Optional[Union[str, List]] = None
     ) -> ExternalAVResult:
-        if not self.result_path.exists():
-            result = []
-        else:
-            result = json.load(self.result_path.open(encoding='utf-8'))
-
         return ExternalAVResult(
-            result_list=result,
+            result_list=self._result_list,
             source_type=source_type
         )
 
 
 class ExportTextData(ExportData):
-    def __init__(
-            self,
-            meta_path: Union[str, Path],
-            **kwargs
-    ):
-        super().__init__(
-            meta_path=meta_path,
-            **kwargs
-        )
+    @cached_property
+    def _info(
+            self
+    ) -> Dict:
+        return self.meta['texts'][0]
 
-        self._info = self.meta['texts'][0]
-        self.org_path: Path = Path(self._info['zipPath'] or self._info['filename'])
+    @cached_property
+    def org_path(
+            self
+    ) -> Path:
+        return Path(self._info['zipPath'] or self._info['filename'])
 
-        self.file: Optional[Path] = self._find_file(folder_name="text_0")
+    @cached_property
+    def file(
+            self
+    ) -> Optional[Path]:
+        return self._find_file(folder_name="text_0")
 
+    @memoize_results
     def get_results(
             self,
             source_type: Optional[Union[str, List]] = None
     ) -> ExternalTextResult:
-        if not self.result_path.exists():
-            result = []
-        else:
-            result = json.load(self.result_path.open(encoding='utf-8'))
-
         return ExternalTextResult(
-            result_list=result,
+            result_list=self._result_list,
             source_type=source_type
         )
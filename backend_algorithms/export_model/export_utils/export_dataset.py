@@ -1,12 +1,52 @@
 import time
 from pathlib import Path
-from typing import Union, Optional, Iterable
+from typing import Union, Optional, Iterable, Iterator
 
 from backend_algorithms.export_model.export_utils.export_data import ExportData, ExportImageData, Export3DLidarData, \
     Export4DLidarData, ExportAVData, ExportTextData
+from backend_algorithms.export_model.export_utils.export_manifest import ExportManifest
 from backend_algorithms.utils.general import find_stack
 
 
+class ExportDataRecord:
+    """ Key-only stand-in of an export data for grouping and sorting: meta path, data id, name and org path.
+
+    The meta dict is not kept, so keys may only use these fields; anything else needs ``load()``,
+    which reads the meta again.
+    """
+    __slots__ = ('meta_path', 'data_id', 'name', 'org_path', '_dataset')
+
+    def __init__(
+            self,
+            single_data: ExportData,
+            dataset: 'ExportDataset'
+    ):
+        self.meta_path: Path = single_data.meta_path
+        self.data_id: int = single_data.data_id
+        self.name: str = single_data.name
+        self.org_path: Path = single_data.org_path
+        self._dataset = dataset
+
+    def __getattr__(
+            self,
+            item
+    ):
+        raise AttributeError(
+            f"{self.__class__.__name__} only has {', '.join(self.__slots__[:-1])}; use load() for '{item}'"
+        )
+
+    def __repr__(
+            self
+    ):
+        return f"{self.__class__.__name__}(meta_path=r'{self.meta_path}')"
+
+    def load(
+            self,
+            **kwargs
+    ) -> ExportData:
+        return self._dataset.load(self.meta_path, **kwargs)
+
+
 class ExportDataset:
     _data_type = ExportData
 
@@ -15,9 +55,14 @@ class ExportDataset:
             root_path,
             logger,
             start_time,
-            add_info
+            add_info,
+            manifest=None
     ):
-        self._jsons = Path(root_path).rglob('**/data/*.json') if isinstance(root_path, (str, Path)) else iter(root_path)
+        if isinstance(root_path, (str, Path)):
+            self._jsons = iter(manifest.data_files) if manifest is not None else Path(root_path).rglob('**/data/*.json')
+        else:
+            self._jsons = iter(root_path)
+        self._manifest = manifest
 
         self._logger = logger
         self._cnt = 0
@@ -38,15 +83,33 @@ class ExportDataset:
         meta_path = Path(next(self._jsons))
         self._cnt += 1
 
+        single_data = self.load(meta_path, no=self._cnt)
+        if self._logger:
+            single_data.log_self()
+
+        return single_data
+
+    def load(
+            self,
+            meta_path: Union[str, Path],
+            no: int = -1
+    ) -> Union[ExportData, ExportImageData, Export3DLidarData, Export4DLidarData, ExportAVData, ExportTextData]:
         return self._data_type(
-            meta_path=meta_path,
-            logger=self._logger,
-            no=self._cnt,
+            meta_path=Path(meta_path),
+            no=no,
             script=self._script,
             start_time=self._start_time,
-            add_info=self._add_info
+            add_info=self._add_info,
+            manifest=self._manifest
         )
 
+    def records(
+            self
+    ) -> Iterator[ExportDataRecord]:
+        """ Key-only records of the remaining data, see ``ExportDataRecord``. """
+        for meta_path in self._jsons:
+            yield ExportDataRecord(self.load(meta_path), dataset=self)
+
     def __str__(
             self
     ):
@@ -66,13 +129,15 @@ class ImageExportDataset(ExportDataset):
             root_path: Union[str, Path, Iterable],
             logger: bool = True,
             start_time: Optional[float] = None,
-            add_info: str = ''
+            add_info: str = '',
+            manifest: Optional[ExportManifest] = None
     ):
         super().__init__(
             root_path=root_path,
             logger=logger,
             start_time=start_time,
-            add_info=add_info
+            add_info=add_info,
+            manifest=manifest
         )
 
     def __next__(
@@ -89,13 +154,15 @@ class Lidar3DExportDataset(ExportDataset):
             root_path: Union[str, Path, Iterable],
             logger: bool = True,
             start_time: Optional[float] = None,
-            add_info: str = ''
+            add_info: str = '',
+            manifest: Optional[ExportManifest] = None
     ):
         super().__init__(
             root_path=root_path,
             logger=logger,
             start_time=start_time,
-            add_info=add_info
+            add_info=add_info,
+            manifest=manifest
         )
 
     def __next__(
@@ -112,13 +179,15 @@ class Lidar4DExportDataset(ExportDataset):
             root_path: Union[str, Path, Iterable],
             logger: bool = True,
             start_time: Optional[float] = None,
-            add_info: str = ''
+            add_info: str = '',
+            manifest: Optional[ExportManifest] = None
     ):
         super().__init__(
             root_path=root_path,
             logger=logger,
             start_time=start_time,
-            add_info=add_info
+            add_info=add_info,
+            manifest=manifest
         )
 
     def __next__(
@@ -135,13 +204,15 @@ class AVExportDataset(ExportDataset):
             root_path: Union[str, Path, Iterable],
             logger: bool = True,
             start_time: Optional[float] = None,
-            add_info: str = ''
+            add_info: str = '',
+            manifest: Optional[ExportManifest] = None
     ):
         super().__init__(
             root_path=root_path,
             logger=logger,
             start_time=start_time,
-            add_info=add_info
+            add_info=add_info,
+            manifest=manifest
         )
 
     def __next__(
@@ -158,13 +229,15 @@ class TextExportDataset(ExportDataset):
             root_path: Union[str, Path, Iterable],
             logger: bool = True,
             start_time: Optional[float] = None,
-            add_info: str = ''
+            add_info: str = '',
+            manifest: Optional[ExportManifest] = None
     ):
         super().__init__(
             root_path=root_path,
             logger=logger,
             start_time=start_time,
-            add_info=add_info
+            add_info=add_info,
+            manifest=manifest
         )
 
     def __next__(
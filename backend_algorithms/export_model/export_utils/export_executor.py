@@ -1,13 +1,50 @@
-import json
+import os
+import re
+import traceback
+import multiprocessing
 from pathlib import Path
-from typing import Callable, Optional, Union, Dict, List
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, Future
+from typing import Callable, Optional, Union, Dict, List, Tuple, Type, Iterable
 
+from loguru import logger
+
+from backend_algorithms.utils import json_codec
 from backend_algorithms.utils.ontology import Ontology
 from backend_algorithms.utils.general import groupby
+from backend_algorithms.utils.fetch import prefetch as prefetch_ahead
+from backend_algorithms.utils.lidar import FrameAggregator, PointCloud
 from backend_algorithms.export_model.export_utils.export_data import ExportData
 from backend_algorithms.export_model.export_utils.export_dataset import ExportDataset, ImageExportDataset, \
     Lidar3DExportDataset, Lidar4DExportDataset, AVExportDataset, TextExportDataset
 from backend_algorithms.export_model.export_utils.export_statistics import Statistics
+from backend_algorithms.export_model.export_utils.export_manifest import ExportManifest
+
+
+def _convert_chunk(
+        data_type: Type[ExportData],
+        meta_paths: List[Path],
+        convert_func: Callable,
+        target_path: Path,
+        result_ext: str,
+        write_params: Optional[Dict],
+        kwargs: Dict
+) -> List[Optional[str]]:
+    errors = []
+    for meta_path in meta_paths:
+        try:
+            single_data = data_type(meta_path=meta_path)
+            single_data.write_result(
+                result=convert_func(single_data, **kwargs),
+                target_path=target_path,
+                file_ext=result_ext,
+                add_params=write_params
+            )
+            errors.append(None)
+        except Exception:
+            errors.append(traceback.format_exc())
+
+    return errors
 
 
 class ExportExecutor:
@@ -24,8 +61,10 @@ class ExportExecutor:
         )
         self.origin_path = Path(input_json.get('originPath'))
         self.target_path = Path(input_json.get('targetPath'))
+        self.workers: Optional[int] = input_json.get('workers')
 
-        self.statistics = Statistics(self.origin_path)
+        self.manifest = ExportManifest(self.origin_path)
+        self.statistics = Statistics(self.origin_path, manifest=self.manifest)
 
     def iter_dataset(
             self,
@@ -33,18 +72,43 @@ class ExportExecutor:
             start_time: Optional[float] = None,
             add_info: str = '',
             files: Optional[List] = None,
+            prefetch: Optional[Union[str, Tuple]] = None,
+            prefetch_frames: int = 4
     ):
+        """
+        :param prefetch: remote assets ('meta', 'bin_pcd', 'org_pcd', ...) to download for the next
+            ``prefetch_frames`` frames while the current one is being converted
+        """
         if files:
             root_path = files
         else:
             root_path = self.origin_path
 
-        return self._dataset_type(
+        dataset = self._dataset_type(
             root_path=root_path,
-            logger=logger,
+            logger=logger and not prefetch,
             start_time=start_time,
-            add_info=add_info
+            add_info=add_info,
+            manifest=self.manifest
         )
+        if prefetch:
+            assets = (prefetch,) if isinstance(prefetch, str) else prefetch
+            return self._log_frames(
+                prefetch_ahead(dataset, lambda x: x.prefetch(*assets), ahead=prefetch_frames), logger
+            )
+
+        return dataset
+
+    @staticmethod
+    def _log_frames(
+            frames: Iterable[ExportData],
+            logger: bool
+    ):
+        # 预取会提前构造后续帧, 日志在真正处理到该帧时再写
+        for single_data in frames:
+            if logger:
+                single_data.log_self()
+            yield single_data
 
     def export_statistics(
             self,
@@ -55,11 +119,10 @@ class ExportExecutor:
 
         self.target_path.mkdir(parents=True, exist_ok=True)
 
-        json.dump(
+        json_codec.dump_file(
             data,
-            (self.target_path / self.statistics.stat_path.name).open('w', encoding="utf-8"),
-            indent='    ',
-            ensure_ascii=False
+            self.target_path / self.statistics.stat_path.name,
+            indent='    '
         )
 
     def convert_single_data(
@@ -86,33 +149,149 @@ class ExportExecutor:
             result_ext: str = ".json",
             files: Optional[List] = None,
             write_params: Optional[Dict] = None,
+            workers: Optional[int] = None,
+            executor: Optional[Executor] = None,
+            chunk_size: int = 16,
+            max_pending: Optional[int] = None,
+            raise_errors: bool = True,
             **kwargs
-    ):
-        for single_data in self.iter_dataset(files=files):
-            self.convert_single_data(
-                single_data=single_data,
-                convert_func=convert_func,
-                result_ext=result_ext,
-                write_params=write_params,
-                **kwargs
+    ) -> Dict[Path, str]:
+        """
+        Convert and write every frame, in this process or, with ``workers > 1`` (the export's
+        ``workers`` by default) or an ``executor``, in chunks of ``chunk_size`` frames on a pool.
+        Either way a failing frame is logged and recorded, the remaining frames are still converted,
+        and the export then fails with one error listing the failed frames.
+
+        On a pool (spawned processes by default) ``convert_func`` and ``kwargs`` must be picklable,
+        at most ``max_pending`` chunks (two per worker by default) are in flight, and frames are
+        logged in dataset order as their chunk completes. A chunk that can not run at all (e.g. an
+        unpicklable ``convert_func`` or a crashed worker) fails each of its frames. Frames are
+        rebuilt from their meta path in the workers without the export manifest, so file lookups
+        there go to disk.
+
+        :param raise_errors: return the failures instead of raising
+        :return: traceback of every failed frame, keyed by meta path
+        """
+        if workers is None:
+            workers = self.workers
+        errors = {}
+
+        if executor is None and (workers or 1) <= 1:
+            for single_data in self.iter_dataset(files=files):
+                try:
+                    self.convert_single_data(
+                        single_data=single_data,
+                        convert_func=convert_func,
+                        result_ext=result_ext,
+                        write_params=write_params,
+                        **kwargs
+                    )
+                except Exception:
+                    self._record_error(errors, single_data.meta_path, traceback.format_exc())
+        else:
+            self._convert_on_pool(
+                errors, convert_func, result_ext, files, write_params, workers, executor, chunk_size,
+                max_pending, kwargs
             )
 
+        if errors:
+            message = f"{len(errors)} data failed to convert: " + ', '.join(str(x) for x in list(errors)[:5]) + \
+                      (', ...' if len(errors) > 5 else '')
+            logger.error(message)
+            if raise_errors:
+                raise RuntimeError(message)
+
+        return errors
+
+    @staticmethod
+    def _record_error(
+            errors: Dict[Path, str],
+            meta_path: Path,
+            error: str
+    ):
+        # 只用meta路径记录, 不再读取可能已损坏的meta
+        errors[meta_path] = error
+        logger.error(f"{meta_path}: {error}")
+
+    def _convert_on_pool(
+            self,
+            errors: Dict[Path, str],
+            convert_func: Callable,
+            result_ext: str,
+            files: Optional[List],
+            write_params: Optional[Dict],
+            workers: Optional[int],
+            executor: Optional[Executor],
+            chunk_size: int,
+            max_pending: Optional[int],
+            kwargs: Dict
+    ):
+        pool = executor or ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        max_pending = max_pending or 2 * (workers or os.cpu_count() or 1)
+        pending = deque()
+
+        def _collect():
+            chunk, future = pending.popleft()
+            try:
+                chunk_errors = future.result()
+            except Exception:
+                chunk_errors = [traceback.format_exc()] * len(chunk)
+            for single_data, error in zip(chunk, chunk_errors):
+                single_data.log_self()
+                if error is not None:
+                    self._record_error(errors, single_data.meta_path, error)
+
+        def _submit(chunk):
+            try:
+                future = pool.submit(
+                    _convert_chunk, self._dataset_type._data_type, [x.meta_path for x in chunk],
+                    convert_func, self.target_path, result_ext, write_params, kwargs
+                )
+            except Exception as e:
+                # 进程池已损坏等, 该块的帧都记为失败
+                future = Future()
+                future.set_exception(e)
+            pending.append((chunk, future))
+            while len(pending) >= max_pending:
+                _collect()
+
+        try:
+            chunk = []
+            for single_data in self.iter_dataset(logger=False, files=files):
+                chunk.append(single_data)
+                if len(chunk) >= chunk_size:
+                    _submit(chunk)
+                    chunk = []
+            if chunk:
+                _submit(chunk)
+            while pending:
+                _collect()
+        finally:
+            if executor is None:
+                pool.shutdown(cancel_futures=True)
+
     def groupby_dataset(
             self,
             groupby_key,
             sort_key: Optional[Callable] = None
     ):
+        """
+        Group (and sort) the dataset by keys computed on ``ExportDataRecord``s, so only the keys of
+        every data stay in memory; full data objects are built while each group is consumed.
+        """
+
         def _gen_data(
                 data_list,
                 start_no
         ):
-            for i, d in enumerate(data_list):
+            for i, r in enumerate(data_list):
+                d = r.load()
                 d.log_self(
                     no=start_no + i
                 )
                 yield d
 
-        dataset = self.iter_dataset(logger=False)
+        dataset = self.iter_dataset(logger=False).records()
         if sort_key is not None:
             dataset = sorted(dataset, key=sort_key)
 
@@ -133,16 +312,20 @@ class ExportExecutor:
     def del_invalid_data(
             self
     ):
-        for file in self.origin_path.rglob("**/result/*.json"):
+        for file in self.manifest.result_files:
             if '"validity":"INVALID",' in file.read_text(encoding="utf-8"):
                 data_file = file.parent.parent / "data" / file.name
                 data_file.unlink()
                 file.unlink()
+                self.manifest.discard(data_file)
+                self.manifest.discard(file)
 
     def copy_export_files(
             self
     ):
-        for x in self.origin_path.rglob("*.*"):
+        for x in self.manifest.iter_files():
+            if '.' not in x.name:
+                continue
             x_output = self.target_path / x.relative_to(self.origin_path)
             x_output.parent.mkdir(parents=True, exist_ok=True)
             x_output.write_bytes(x.read_bytes())
@@ -162,15 +345,73 @@ class ImageExportExecutor(ExportExecutor):
                         x.org_path.suffix
                     )
                 )
+                self.manifest.discard(x.file)
 
 
 class Lidar3DExportExecutor(ExportExecutor):
     _dataset_type = Lidar3DExportDataset
 
+    def __init__(
+            self,
+            input_json
+    ):
+        super().__init__(input_json)
+
+        self.pcd_preprocess: Dict = input_json.get('pcdPreprocess') or {}
+
+    def preprocess_pcd(
+            self,
+            pc: PointCloud
+    ) -> PointCloud:
+        """
+        Apply the pcdPreprocess options of the export, cropping before downsampling:
+        {"radius": max or [min, max], "height": max or [min, max], "voxelSize": float, "voxelReduce": "mean" | "first"}
+        """
+        radius = self.pcd_preprocess.get('radius')
+        height = self.pcd_preprocess.get('height')
+        if radius is not None or height is not None:
+            pc = pc.crop(radius=radius, height=height)
+
+        voxel_size = self.pcd_preprocess.get('voxelSize')
+        if voxel_size:
+            pc = pc.voxel_downsample(voxel_size, reduce=self.pcd_preprocess.get('voxelReduce') or 'mean')
 
-class Lidar4DExportExecutor(ExportExecutor):
+        return pc
+
+
+class Lidar4DExportExecutor(Lidar3DExportExecutor):
     _dataset_type = Lidar4DExportDataset
 
+    def iter_aggregated(
+            self,
+            window: int = 5,
+            prefetch_frames: int = 4
+    ):
+        """
+        Walk every sequence frame by frame, yielding each frame with a ``FrameAggregator``
+        that holds it and up to ``window - 1`` previous frames of the same sequence.
+        """
+
+        def _frame_key(
+                meta_path: Path
+        ):
+            return str(meta_path.parent), [int(x) if x.isdigit() else x for x in re.split(r'(\d+)', meta_path.stem)]
+
+        files = sorted(self.manifest.data_files, key=_frame_key)
+
+        sequence, aggregator = None, None
+        for single_data in self.iter_dataset(files=files, prefetch=('org_pcd', 'ego_config'),
+                                             prefetch_frames=prefetch_frames):
+            if single_data.meta_path.parent != sequence:
+                sequence, aggregator = single_data.meta_path.parent, FrameAggregator(window=window)
+
+            ego_config = single_data.get_ego_config()
+            if ego_config is None:
+                raise ValueError(f"{single_data} lacks an ego vehicle config")
+
+            aggregator.push(single_data.get_org_pcd().data, ego_config)
+            yield single_data, aggregator
+
 
 class AVExportExecutor(ExportExecutor):
     _dataset_type = AVExportDataset
@@ -0,0 +1,108 @@
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+
+class ExportManifest:
+    """ Every file of an export tree, collected with a single ``os.scandir`` walk.
+
+    Files are kept as names grouped by directory, in scan order, so listing data/result files,
+    finding the statistic file and existence checks need no further directory traversal.
+    Changes made to the tree afterwards must be reported through ``add``/``discard``.
+    Symlinks to directories are not followed.
+    """
+
+    def __init__(
+            self,
+            root_path: Union[str, Path]
+    ):
+        self.root_path = Path(root_path)
+        self._root_prefix = os.path.join(str(self.root_path), '')
+        self._dirs: Dict[str, List[str]] = {}
+        self._sets: Dict[str, set] = {}
+
+        stack = [str(self.root_path)]
+        while stack:
+            cur_dir = stack.pop()
+            names = []
+            sub_dirs = []
+            try:
+                with os.scandir(cur_dir) as it:
+                    for entry in it:
+                        # 不进入指向目录的软链接, 避免成环
+                        if entry.is_dir(follow_symlinks=False):
+                            sub_dirs.append(entry.path)
+                        elif not entry.is_dir():
+                            names.append(entry.name)
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+            if names:
+                self._dirs[cur_dir] = names
+            stack.extend(reversed(sub_dirs))
+
+    def __len__(
+            self
+    ):
+        return sum(len(x) for x in self._dirs.values())
+
+    def iter_files(
+            self,
+            dir_name: Optional[str] = None,
+            suffix: Optional[str] = None
+    ):
+        """
+        :param dir_name: only files directly inside directories with this name
+        :param suffix: only files with this suffix, e.g. ".json"
+        """
+        for cur_dir, names in self._dirs.items():
+            if dir_name is not None and os.path.basename(cur_dir) != dir_name:
+                continue
+            for name in names:
+                if suffix is None or os.path.splitext(name)[1] == suffix:
+                    yield Path(cur_dir, name)
+
+    @property
+    def data_files(
+            self
+    ) -> List[Path]:
+        return list(self.iter_files(dir_name='data', suffix='.json'))
+
+    @property
+    def result_files(
+            self
+    ) -> List[Path]:
+        return list(self.iter_files(dir_name='result', suffix='.json'))
+
+    def exists(
+            self,
+            path: Union[str, Path]
+    ) -> bool:
+        """ Looked up in the manifest for paths under its root, checked on disk otherwise. """
+        if not str(path).startswith(self._root_prefix):
+            return os.path.exists(path)
+
+        cur_dir, name = os.path.split(str(path))
+        if cur_dir not in self._sets:
+            self._sets[cur_dir] = set(self._dirs.get(cur_dir, ()))
+        return name in self._sets[cur_dir]
+
+    def add(
+            self,
+            path: Union[str, Path]
+    ):
+        if not str(path).startswith(self._root_prefix) or self.exists(path):
+            return
+        cur_dir, name = os.path.split(str(path))
+        self._dirs.setdefault(cur_dir, []).append(name)
+        self._sets[cur_dir].add(name)
+
+    def discard(
+            self,
+            path: Union[str, Path]
+    ):
+        if not str(path).startswith(self._root_prefix) or not self.exists(path):
+            return
+        cur_dir, name = os.path.split(str(path))
+        self._dirs[cur_dir].remove(name)
+        self._sets[cur_dir].discard(name)
@@ -1,5 +1,8 @@
 import json
 from pathlib import Path
+from typing import Optional
+
+from backend_algorithms.export_model.export_utils.export_manifest import ExportManifest
 
 
 class DataStat:
@@ -28,10 +31,16 @@ class ResultStat:
 class Statistics:
     def __init__(
             self,
-            root_path: Path
+            root_path: Path,
+            manifest: Optional[ExportManifest] = None
     ):
+        if manifest is not None:
+            stat_files = (x for x in manifest.iter_files(suffix=".json") if x.name == "statistic.json")
+        else:
+            stat_files = root_path.rglob("**/statistic.json")
+
         try:
-            self.stat_path = next(root_path.rglob("**/statistic.json"))
+            self.stat_path = next(stat_files)
             raw_data = json.load(self.stat_path.open(encoding="utf-8"))
             d, r = raw_data["data"], raw_data["result"]
         except StopIteration:
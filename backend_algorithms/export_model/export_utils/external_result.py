@@ -91,9 +91,12 @@ class ExternalLidarResult(ExternalResult, LidarBaseResult):
     def __init__(
             self,
             result_list: List,
-            segmentation: PointCloud,
+            segmentation: Union[PointCloud, Callable[[], PointCloud]],
             source_type: Optional[Union[str, List]] = None
     ):
+        """
+        :param segmentation: the segmentation cloud, or a callable loading it on first access
+        """
         ExternalResult.__init__(
             self,
             result_list=result_list,
@@ -106,7 +109,22 @@ class ExternalLidarResult(ExternalResult, LidarBaseResult):
             segments=self._prepare_instances(key_name="segments"),
             instance_map=lidar_map
         )
-        self.segmentation = segmentation
+        self._segmentation = segmentation
+
+    @property
+    def segmentation(
+            self
+    ) -> PointCloud:
+        if callable(self._segmentation):
+            self._segmentation = self._segmentation()
+        return self._segmentation
+
+    @segmentation.setter
+    def segmentation(
+            self,
+            value: PointCloud
+    ):
+        self._segmentation = value
 
 
 class ExternalAVResult(ExternalResult, AVBaseResult):
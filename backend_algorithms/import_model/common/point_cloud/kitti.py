@@ -5,10 +5,13 @@ import os
 from os.path import *
 import json
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from nanoid import generate
 from numpy.linalg import inv
 from loguru import logger
 
+from backend_algorithms.utils.lidar import PointCloud
+
 
 def trans(input_json):
     code = 'OK'
@@ -22,7 +25,7 @@ def trans(input_json):
         for data_path in data_paths:
             dataset_path = dirname(data_path)
             target_save_path = dataset_path.replace(origin_path, target_path)
-            kittidataset = KittiDataset(dataset_path, target_save_path, class_mapping)
+            kittidataset = KittiDataset(dataset_path, target_save_path, class_mapping, input_json.get('workers'))
             check_source = kittidataset.irregular_structure()
             if check_source:
                 code = 'ERROR'
@@ -110,8 +113,11 @@ class MessageCollecter:
 
 
 class KittiDataset:
-    def __init__(self, dataset_dir, output_dir, class_mapping):
+    bin_dtype = np.dtype([('x', 'float32'), ('y', 'float32'), ('z', 'float32'), ('i', 'float32')])
+
+    def __init__(self, dataset_dir, output_dir, class_mapping, workers=None):
         self.mc = MessageCollecter()
+        self.workers = workers
         self.dataset_dir = dataset_dir
         self.calib_dir = join(dataset_dir, 'calib')
         self.image_dir = join(dataset_dir, 'image_2')
@@ -134,12 +140,10 @@ class KittiDataset:
 
     def import_dataset(self):
         """处理数据:以bin文件为基础，查找对应其他资源文件，若缺少相机参数文件，参数文件解析失败，结果解析失败等，此帧跳过"""
-        for bin_file in list_files(self.velodyne_dir, '.bin'):
+        bin_files = list_files(self.velodyne_dir, '.bin')
+        for bin_file, error in zip(bin_files, self.convert_bins(bin_files)):
             file_name = splitext(basename(bin_file))[0]
-            pcd_file = join(self.pc_dir, file_name + '.pcd')
-            try:
-                self.bin_to_pcd(bin_file, pcd_file)
-            except Exception:
+            if error is not None:
                 self.mc('Some bin file cannot be parsed', f'e.g.:{relpath(bin_file, self.dataset_dir)}')
 
             calib_file = join(self.calib_dir, file_name + '.txt')
@@ -179,38 +183,33 @@ class KittiDataset:
         pi = math.pi
         return alpha - math.floor((alpha + pi) / (2 * pi)) * 2 * pi
 
-    # 将点数据写入pcd文件(encoding=ascii)
-    @staticmethod
-    def bin_to_pcd(bin_file: str, pcd_file: str):
-        try:
-            with open(bin_file, 'rb') as bf:
-                bin_data = bf.read()
-                dtype = np.dtype([('x', 'float32'), ('y', 'float32'), ('z', 'float32'), ('i', 'float32')])
-                points = np.frombuffer(bin_data, dtype=dtype)
-                points = [list(o) for o in points]
-                points = np.array(points)
-                with open(pcd_file, 'wb') as pcd_file:
-                    point_num = points.shape[0]
-                    heads = [
-                        '# .PCD v0.7 - Point Cloud Data file format',
-                        'VERSION 0.7',
-                        'FIELDS x y z i',
-                        'SIZE 4 4 4 4',
-                        'TYPE F F F U',
-                        'COUNT 1 1 1 1',
-                        f'WIDTH {point_num}',
-                        'HEIGHT 1',
-                        'VIEWPOINT 0 0 0 1 0 0 0',
-                        f'POINTS {point_num}',
-                        'DATA binary'
-                    ]
-                    header = '\n'.join(heads) + '\n'
-                    header = bytes(header, 'ascii')
-                    pcd_file.write(header)
-                    pcd_file.write(points.tobytes())
-        except Exception as e:
-            print(f"{e}\n{bin_file} to {pcd_file} ===> failed : {bin_file} "
-                  f"dtype isn't [('x','float32'),('y','float32'),('z','float32'),('i','float32')]")
+    def convert_bins(self, bin_files):
+        """在进程池中将bin文件转换为pcd, 按bin文件顺序依次返回转换异常(成功为None)"""
+        pcd_files = [join(self.pc_dir, splitext(basename(x))[0] + '.pcd') for x in bin_files]
+        if self.workers == 1:
+            for bin_file, pcd_file in zip(bin_files, pcd_files):
+                try:
+                    self.bin_to_pcd(bin_file, pcd_file)
+                    yield None
+                except Exception as e:
+                    yield e
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.bin_to_pcd, b, p) for b, p in zip(bin_files, pcd_files)]
+            for future in futures:
+                yield future.exception()
+
+    # 将点数据写入pcd文件(DATA binary), bin文件的点排布与pcd一致, 直接拷贝
+    @classmethod
+    def bin_to_pcd(cls, bin_file: str, pcd_file: str):
+        size = os.path.getsize(bin_file)
+        if size % cls.bin_dtype.itemsize:
+            raise ValueError(f"{bin_file} dtype isn't {cls.bin_dtype.descr}")
+
+        with open(bin_file, 'rb') as bf, open(pcd_file, 'wb') as pf:
+            pf.write(PointCloud.make_header(cls.bin_dtype, size // cls.bin_dtype.itemsize))
+            shutil.copyfileobj(bf, pf, 1 << 22)
 
     @staticmethod
     def parse_cam_param(calib_file, cfg_file):
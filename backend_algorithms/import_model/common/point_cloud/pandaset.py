@@ -1,71 +1,109 @@
 import json
 import pickle
 from pathlib import Path
+from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 from scipy.spatial.transform import Rotation as R
 
 from backend_algorithms.import_model.import_utils.import_dataset import ImportLidarDataset
-from backend_algorithms.utils.lidar import transform_matrix, header
+from backend_algorithms.utils.lidar import PointCloud
 
+direc_map = {
+    "front_camera": 0,
+    "left_camera": 1,
+    "back_camera": 2,
+    "right_camera": 3,
+    "front_left_camera": 4,
+    "front_right_camera": 5
+}
 
-def trans(input_json):
-    origin_path = Path(input_json.get('originPath'))
-    target_path = Path(input_json.get('targetPath'))
+pcd_dtype = np.dtype([('x', 'float32'), ('y', 'float32'), ('z', 'float32'), ('i', 'int32')])
 
-    direc_map = {
-        "front_camera": 0,
-        "left_camera": 1,
-        "back_camera": 2,
-        "right_camera": 3,
-        "front_left_camera": 4,
-        "front_right_camera": 5
-    }
-    n_direcs = len(direc_map)
 
-    for pkl_data in ImportLidarDataset(origin_path, "**/lidar/*.pkl"):
-        pkl_file = pkl_data.meta_path
-        pc_df = pickle.loads(pkl_file.read_bytes())
-        xyzi_df = pc_df[["x", "y", "z", "i"]].astype(np.float32)
-        xyzi_df["i"] = xyzi_df["i"].astype(int)
+def load_sequence_config(
+        seq_path: Path
+) -> List[List[Dict]]:
+    """
+    Parse the intrinsics and poses of every camera of a sequence once.
 
-        n_points = len(xyzi_df)
-        header_data = header.format(n_points, n_points)
-        pcd_data = header_data.encode() + xyzi_df.to_records(index=False).tobytes()
+    :return: camera config of every frame, indexed by frame number
+    """
+    n_direcs = len(direc_map)
+    int_configs = [{}] * n_direcs
+    ext_mats = [None] * n_direcs
+    for cur_direc, cur_direc_i in direc_map.items():
+        cam_path = seq_path / "camera" / cur_direc
+        int_configs[cur_direc_i] = json.loads((cam_path / "intrinsics.json").read_text(encoding="utf-8"))
+
+        poses = json.loads((cam_path / "poses.json").read_text(encoding="utf-8"))
+        t = np.array([[p["position"][k] for k in ("x", "y", "z")] for p in poses], dtype=np.float64)
+        quat = np.array([[p["heading"][k] for k in ("x", "y", "z", "w")] for p in poses], dtype=np.float64)
+        trans_mat = np.tile(np.eye(4), (len(poses), 1, 1))
+        trans_mat[:, :3, :3] = R.from_quat(quat).as_matrix()
+        trans_mat[:, :3, 3] = t
+        ext_mats[cur_direc_i] = np.linalg.inv(trans_mat).reshape(len(poses), -1)
+
+    n_frames = min(len(x) for x in ext_mats)
+
+    return [
+        [
+            {
+                "camera_internal": int_configs[i],
+                "camera_external": ext_mats[i][frame].tolist(),
+            }
+            for i in range(n_direcs)
+        ]
+        for frame in range(n_frames)
+    ]
 
-        pcd_output = pkl_data.prepare_target_path(target_path).with_suffix(".pcd")
-        pcd_output.write_bytes(pcd_data)
 
-        for cur_direc, cur_direc_i in direc_map.items():
-            img_path = pkl_file.parent.parent / "camera" / cur_direc / pkl_file.with_suffix(".jpg").name
+def convert_frame(
+        pkl_file: Path,
+        pcd_output: Path,
+        x1_config: List[Dict]
+):
+    pc_df = pickle.loads(pkl_file.read_bytes())
 
-            if not img_path.exists():
-                continue
+    points = np.empty(len(pc_df), dtype=pcd_dtype)
+    for name in pcd_dtype.names:
+        points[name] = pc_df[name].to_numpy()
+    PointCloud.save_pcd(points, pcd_output)
 
-            img_output = pcd_output.parent.parent / f"camera_image_{cur_direc_i}" / pcd_output.with_suffix(
-                ".jpg").name
-            img_output.parent.mkdir(parents=True, exist_ok=True)
-            img_output.write_bytes(img_path.read_bytes())
+    for cur_direc, cur_direc_i in direc_map.items():
+        img_path = pkl_file.parent.parent / "camera" / cur_direc / pkl_file.with_suffix(".jpg").name
 
-        x1_config = [{}] * n_direcs
-        for cur_direc, cur_direc_i in direc_map.items():
-            int_path = pkl_file.parent.parent / "camera" / cur_direc / "intrinsics.json"
-            ext_path = pkl_file.parent.parent / "camera" / cur_direc / "poses.json"
+        if not img_path.exists():
+            continue
 
-            int_config = json.loads(int_path.read_text(encoding="utf-8"))
-            ext_config = json.loads(ext_path.read_text(encoding="utf-8"))[int(pkl_file.stem)]
+        img_output = pcd_output.parent.parent / f"camera_image_{cur_direc_i}" / pcd_output.with_suffix(
+            ".jpg").name
+        img_output.parent.mkdir(parents=True, exist_ok=True)
+        img_output.write_bytes(img_path.read_bytes())
 
-            t = list(ext_config["position"].values())
-            quat = ext_config["heading"]
-            r = R.from_quat([quat['x'], quat['y'], quat['z'], quat['w']]).as_matrix()
-            trans_mat = np.linalg.inv(transform_matrix(t, r))
+    config_output = pcd_output.parent.parent / "camera_config" / pcd_output.with_suffix(".json").name
+    config_output.parent.mkdir(parents=True, exist_ok=True)
+    config_output.write_text(json.dumps(x1_config), encoding="utf-8")
 
-            new_config = {
-                "camera_internal": int_config,
-                "camera_external": trans_mat.ravel().tolist(),
-            }
-            x1_config[cur_direc_i] = new_config
 
-        config_output = pcd_output.parent.parent / "camera_config" / pcd_output.with_suffix(".json").name
-        config_output.parent.mkdir(parents=True, exist_ok=True)
-        config_output.write_text(json.dumps(x1_config), encoding="utf-8")
+def trans(input_json):
+    origin_path = Path(input_json.get('originPath'))
+    target_path = Path(input_json.get('targetPath'))
+
+    seq_configs = {}
+    with ProcessPoolExecutor(max_workers=input_json.get('workers')) as pool:
+        futures = []
+        for pkl_data in ImportLidarDataset(origin_path, "**/lidar/*.pkl"):
+            pkl_file = pkl_data.meta_path
+            seq_path = pkl_file.parent.parent
+            if seq_path not in seq_configs:
+                seq_configs[seq_path] = load_sequence_config(seq_path)
+
+            pcd_output = pkl_data.prepare_target_path(target_path).with_suffix(".pcd")
+            futures.append(
+                pool.submit(convert_frame, pkl_file, pcd_output, seq_configs[seq_path][int(pkl_file.stem)])
+            )
+
+        for future in futures:
+            future.result()
@@ -1,10 +1,11 @@
 import time
-import json
 from pathlib import Path
 from typing import Union, Optional, Dict
 
 from loguru import logger
 
+from backend_algorithms.utils import json_codec
+
 
 class ImportData:
     def __init__(
@@ -79,7 +80,7 @@ class ImportData:
             result: Dict
     ) -> Path:
         json_output.parent.mkdir(parents=True, exist_ok=True)
-        json_output.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        json_output.write_bytes(json_codec.dumps(result, ensure_ascii=False))
 
         return json_output
 
@@ -114,7 +115,7 @@ class ImportLidarData(ImportData):
     ):
         config_output = lid_output.parent.parent / "camera_config" / lid_output.with_suffix(".json").name
         config_output.parent.mkdir(parents=True, exist_ok=True)
-        config_output.write_text(json.dumps(config), encoding="utf-8")
+        config_output.write_bytes(json_codec.dumps(config))
 
     @staticmethod
     def write_image(
@@ -144,7 +145,7 @@ class ImportLidarData(ImportData):
     ):
         config_output = lid_output.parent.parent / "ego_vehicle_config" / lid_output.with_suffix(".json").name
         config_output.parent.mkdir(parents=True, exist_ok=True)
-        config_output.write_text(json.dumps(config), encoding="utf-8")
+        config_output.write_bytes(json_codec.dumps(config))
 
 
 class ImportAVData(ImportData):
@@ -2,6 +2,7 @@ import math
 from typing import Dict, List, Optional, Union
 
 from backend_algorithms.utils.general import AlwaysTrueList
+from backend_algorithms.utils.lidar import PointCloud
 
 
 class RuleInfo:
@@ -48,6 +49,12 @@ class LidarRuleInfo(RuleInfo):
         self.hmin: Union[float, int] = h.get('min') or -math.inf
         self.hmax: Union[float, int] = h.get('max') or math.inf
 
+    def crop(
+            self,
+            pc: PointCloud
+    ) -> PointCloud:
+        return pc.crop(radius=(self.rmin, self.rmax), height=(self.hmin, self.hmax))
+
 
 class AVRuleInfo(RuleInfo):
     def __init__(
@@ -1,6 +1,5 @@
 import sys
 import importlib
-import json
 from typing import Tuple, List
 
 import uvicorn
@@ -9,6 +8,7 @@ from fastapi.responses import JSONResponse
 from loguru import logger
 
 from backend_algorithms.service.base_post import handle_post
+from backend_algorithms.utils import json_codec
 from backend_algorithms.service.post_body import QABody, AddInfo, ImportBody, ExportBody, ImageModelBody
 from backend_algorithms.calculate_info.point_cloud_info import cal_point_cloud_info
 from backend_algorithms.calculate_info.image_info import cal_image_info
@@ -72,7 +72,7 @@ def custom_qa_rule(
             f"backend_algorithms.qa_rule.{rule_code.replace('-', '.')}"
         )
 
-        return module.detect(json.load(body.filePath.open(encoding="utf-8")))
+        return module.detect(json_codec.load_file(body.filePath))
 
     _, _, status_code, result = handle_post(
         _qa,
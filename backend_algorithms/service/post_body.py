@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Dict
 from pathlib import Path
 
 from pydantic import BaseModel
@@ -21,6 +21,9 @@ class ExportBody(BaseModel):
     targetPath: str
     datasetClassList: List
     datasetClassificationList: List
+    frameWindow: Optional[int]
+    pcdPreprocess: Optional[Dict]
+    workers: Optional[int]
 
 
 class ImportBody(BaseModel):
@@ -28,6 +31,7 @@ class ImportBody(BaseModel):
     targetPath: str
     datasetClassList: List
     datasetClassificationList: List
+    workers: Optional[int]
 
 
 class ImageModelBody(BaseModel):
@@ -4,7 +4,7 @@ import numpy as np
 from shapely.geometry import Polygon as SPolygon, Point, LineString
 
 from backend_algorithms.utils.image import find_diagonal, points_to_list, round_points
-from backend_algorithms.utils.lidar import get_pose, get_corners, alpha_in_pi
+from backend_algorithms.utils.lidar import get_pose, get_corners_batch, alpha_in_pi
 from backend_algorithms.utils.general import reg_dict, drop_duplicates, CustomTree, seconds_to_hms
 
 
@@ -490,13 +490,21 @@ class Lidar3DBox(Lidar3DInstance):
             *self.rotation.values()
         )
 
-    def get_corners(
+    def to_array(
             self
     ) -> np.ndarray:
-        return get_corners(
+        return np.array([
+            *self.center.values(),
             *self.size.values(),
-            self.affine_matrix
-        )
+            *self.rotation.values()
+        ], dtype=np.float64)
+
+    def get_corners(
+            self
+    ) -> np.ndarray:
+        return get_corners_batch(
+            self.to_array()
+        )[0]
 
     def rotation_in_pi(
             self
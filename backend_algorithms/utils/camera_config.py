@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Iterable, Optional, Union
+
+from loguru import logger
+
+from backend_algorithms.utils.fetch import fetcher
+
+
+class CameraConfigCache:
+    """ Camera configs fetched by url, stored once per distinct content and spilled to disk.
+
+    A url seen within ``max_age`` seconds is served from memory. Older entries, and entries
+    left on disk by an earlier process, are revalidated with their ETag before the stored
+    content is reused; fetched bodies are checked against Content-Length.
+
+    Without an explicit ``spill_dir`` the spill goes to a temporary directory, created on first
+    use and removed when the cache is closed or garbage collected, or at interpreter exit.
+    Requests go through the shared ``fetcher`` session.
+    """
+
+    def __init__(
+            self,
+            spill_dir: Optional[Union[str, Path]] = None,
+            max_age: float = 600,
+            timeout: float = 30
+    ):
+        self._spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self._tmp_dir = None
+        self._dir_lock = threading.Lock()
+        self.max_age = max_age
+        self.timeout = timeout
+
+        self._urls: Dict[str, Dict] = {}
+        self._contents: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+
+    @property
+    def spill_dir(
+            self
+    ) -> Path:
+        with self._dir_lock:
+            if self._spill_dir is None:
+                self._tmp_dir = tempfile.TemporaryDirectory(prefix='camera_config_cache_')
+                self._spill_dir = Path(self._tmp_dir.name)
+            return self._spill_dir
+
+    def get(
+            self,
+            url: str
+    ) -> List:
+        with self._lock:
+            future = self._inflight.get(url)
+        content = future.result() if future is not None else self._get_content(url)
+
+        return json.loads(content)
+
+    def prefetch(
+            self,
+            urls: Iterable[str],
+            workers: int = 8
+    ) -> Dict[str, Optional[Exception]]:
+        """
+        Fetch every distinct url concurrently.
+
+        :return: the exception raised for each url that failed
+        """
+        urls = list(dict.fromkeys(x for x in urls if x))
+        if not urls:
+            return {}
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as pool:
+            for url, future in [(x, pool.submit(self._get_content, x)) for x in urls]:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.warning(f"prefetch camera config failed: {url}, {e}")
+                    errors[url] = e
+
+        return errors
+
+    def submit(
+            self,
+            url: Optional[str],
+            workers: int = 8
+    ) -> Optional[Future]:
+        """ Start fetching ``url`` in the background; a ``get`` of it meanwhile waits for this fetch. """
+        if not url:
+            return None
+
+        with self._lock:
+            if url in self._inflight:
+                return self._inflight[url]
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='camera_config')
+            future = self._inflight[url] = self._pool.submit(self._get_content, url)
+
+        future.add_done_callback(lambda _: self._done(url, future))
+        return future
+
+    def close(
+            self
+    ):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        with self._dir_lock:
+            if self._tmp_dir is not None:
+                self._tmp_dir.cleanup()
+                self._tmp_dir = self._spill_dir = None
+
+    def invalidate(
+            self,
+            url: Optional[str] = None
+    ):
+        with self._lock:
+            if url is None:
+                self._urls.clear()
+                self._contents.clear()
+            else:
+                self._urls.pop(url, None)
+        if url is not None:
+            self._entry_path(url).unlink(missing_ok=True)
+
+    def stats(
+            self
+    ) -> Dict:
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'urls': len(self._urls),
+                'contents': len(self._contents)
+            }
+
+    def _get_content(
+            self,
+            url: str
+    ) -> bytes:
+        with self._lock:
+            entry = self._urls.get(url)
+            if entry and time.time() - entry['checked'] < self.max_age:
+                self._hits += 1
+                return self._contents[entry['digest']]
+
+        if entry is None:
+            entry = self._load_entry(url)
+
+        headers = {'If-None-Match': entry['etag']} if entry and entry.get('etag') else {}
+        resp = fetcher.get(url, timeout=self.timeout, headers=headers)
+        if resp.status_code == 304:
+            content = self._load_content(entry['digest'])
+            if content is not None:
+                self._store(url, entry, content)
+                with self._lock:
+                    self._hits += 1
+                return content
+            resp = fetcher.get(url, timeout=self.timeout)
+
+        content = resp.content
+        size = resp.headers.get('Content-Length')
+        if size is not None and 'Content-Encoding' not in resp.headers and int(size) != len(content):
+            raise IOError(f"incomplete camera config: expected {size} bytes, got {len(content)}, {url}")
+
+        entry = {
+            'url': url,
+            'etag': resp.headers.get('ETag'),
+            'size': len(content),
+            'digest': hashlib.sha1(content).hexdigest()
+        }
+        self._store(url, entry, content)
+        self._spill(entry, content)
+        with self._lock:
+            self._misses += 1
+
+        return content
+
+    def _done(
+            self,
+            url: str,
+            future: Future
+    ):
+        with self._lock:
+            if self._inflight.get(url) is future:
+                del self._inflight[url]
+
+    def _store(
+            self,
+            url: str,
+            entry: Dict,
+            content: bytes
+    ):
+        with self._lock:
+            self._contents.setdefault(entry['digest'], content)
+            self._urls[url] = {**entry, 'checked': time.time()}
+
+    def _entry_path(
+            self,
+            url: str
+    ) -> Path:
+        return self.spill_dir / 'urls' / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+
+    def _load_entry(
+            self,
+            url: str
+    ) -> Optional[Dict]:
+        entry_path = self._entry_path(url)
+        try:
+            entry = json.loads(entry_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+        return entry if entry.get('url') == url else None
+
+    def _load_content(
+            self,
+            digest: str
+    ) -> Optional[bytes]:
+        with self._lock:
+            if digest in self._contents:
+                return self._contents[digest]
+
+        try:
+            content = (self.spill_dir / f"{digest}.json").read_bytes()
+        except OSError:
+            return None
+
+        return content if hashlib.sha1(content).hexdigest() == digest else None
+
+    def _spill(
+            self,
+            entry: Dict,
+            content: bytes
+    ):
+        try:
+            content_path = self.spill_dir / f"{entry['digest']}.json"
+            if not content_path.exists():
+                self._atomic_write(content_path, content)
+            self._atomic_write(self._entry_path(entry['url']), json.dumps(entry).encode('utf-8'))
+        except OSError as e:
+            logger.warning(f"spill camera config failed: {entry['url']}, {e}")
+
+    @staticmethod
+    def _atomic_write(
+            path: Path,
+            content: bytes
+    ):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+camera_config_cache = CameraConfigCache()
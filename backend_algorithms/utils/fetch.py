@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterable, Iterator, Callable, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class Fetcher:
+    """ Shared http fetch layer: one pooled session with timeout and retry, plus a bounded thread pool. """
+
+    def __init__(
+            self,
+            workers: int = 8,
+            timeout: Union[float, Tuple[float, float]] = (10, 120),
+            retries: int = 3,
+            backoff: float = 0.5
+    ):
+        self.workers = workers
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=workers,
+            pool_maxsize=workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=('GET', 'HEAD')
+            )
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get(
+            self,
+            url: str,
+            **kwargs
+    ) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        resp = self.session.get(url, **kwargs)
+        resp.raise_for_status()
+
+        return resp
+
+    def submit(
+            self,
+            url: str,
+            **kwargs
+    ) -> Future:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fetch')
+
+        return self._pool.submit(self.get, url, **kwargs)
+
+
+fetcher = Fetcher()
+
+
+def prefetch(
+        items: Iterable,
+        func: Callable,
+        ahead: int = 4
+) -> Iterator:
+    """
+    Yield items in order, calling ``func`` on each of them up to ``ahead`` items before it is yielded.
+
+    ``func`` is expected to start background work (e.g. ``ExportData.prefetch``) and return quickly.
+    """
+    items = iter(items)
+    window = deque()
+    for x in items:
+        func(x)
+        window.append(x)
+        if len(window) > ahead:
+            yield window.popleft()
+
+    while window:
+        yield window.popleft()
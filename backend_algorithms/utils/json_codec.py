@@ -0,0 +1,96 @@
+""" JSON encode/decode on bytes, through orjson or ujson when installed and the stdlib otherwise.
+
+Options a backend can not honour (e.g. ``ensure_ascii=True`` or a 4 space indent with orjson) fall
+back to the stdlib. ``NaN``/``Infinity`` tokens, which the stdlib accepts, are always read; on
+write orjson turns them into ``null`` unless ``allow_nan=True`` asks for the stdlib's bare tokens.
+"""
+import json
+from pathlib import Path
+from typing import Any, Union, Optional, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+backends = [x for x, m in (('orjson', orjson), ('ujson', ujson)) if m is not None] + ['json']
+backend = backends[0]
+
+
+def set_backend(
+        name: str
+):
+    global backend
+
+    if name not in backends:
+        raise ValueError(f"json backend '{name}' is not available, choose from {backends}")
+    backend = name
+
+
+def loads(
+        data: Union[bytes, bytearray, memoryview, str]
+) -> Any:
+    try:
+        if backend == 'orjson':
+            return orjson.loads(data)
+        if backend == 'ujson':
+            return ujson.loads(data)
+    except ValueError:
+        pass
+    return json.loads(data)
+
+
+def dumps(
+        obj: Any,
+        ensure_ascii: bool = False,
+        indent: Optional[Union[int, str]] = None,
+        sort_keys: bool = False,
+        default: Optional[Callable] = None,
+        allow_nan: bool = False,
+        **kwargs
+) -> bytes:
+    """
+    Serialize to UTF-8 bytes; extra keyword arguments are passed to the stdlib encoder.
+
+    :param allow_nan: write non-finite floats as ``NaN``/``Infinity`` tokens through the stdlib;
+        otherwise orjson writes them as ``null`` (ujson can not encode them and falls back)
+    """
+    if backend == 'orjson' and not allow_nan and not ensure_ascii and indent in (None, 2) and not kwargs:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass
+
+    if backend == 'ujson' and not allow_nan and default is None and not kwargs and isinstance(indent, (int, type(None))):
+        try:
+            return ujson.dumps(obj, ensure_ascii=ensure_ascii, indent=indent or 0, sort_keys=sort_keys).encode('utf-8')
+        except (TypeError, OverflowError):
+            pass
+
+    return json.dumps(
+        obj, ensure_ascii=ensure_ascii, indent=indent, sort_keys=sort_keys, default=default, **kwargs
+    ).encode('utf-8')
+
+
+def load_file(
+        path: Union[str, Path]
+) -> Any:
+    return loads(Path(path).read_bytes())
+
+
+def dump_file(
+        obj: Any,
+        path: Union[str, Path],
+        **kwargs
+) -> int:
+    return Path(path).write_bytes(dumps(obj, **kwargs))
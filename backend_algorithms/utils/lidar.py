@@ -1,13 +1,17 @@
+import os
 import re
 import struct
 import math
+import threading
+from collections import OrderedDict, deque
 from itertools import product
 from pathlib import Path
-from typing import List, Union, Dict, Tuple
+from typing import List, Union, Dict, Tuple, Optional
 
 import numpy as np
 import lzf
 from numpy.lib.recfunctions import repack_fields
+from scipy.spatial import cKDTree
 from scipy.spatial.transform import Rotation as R
 from shapely.geometry import Point, MultiPoint
 
@@ -85,9 +89,43 @@ def to_basic_int(
 
 def alpha_in_pi(a):
     pi = math.pi
+    if isinstance(a, np.ndarray):
+        return a - np.floor((a + pi) / (2 * pi)) * 2 * pi
     return a - math.floor((a + pi) / (2 * pi)) * 2 * pi
 
 
+def project_boxes_to_cameras(
+        ext_matrices: np.ndarray,
+        centers: np.ndarray,
+        heights: np.ndarray,
+        rz: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    KITTI camera-frame location, rotation_y and alpha of lidar 3D boxes, for all cameras at once.
+
+    :param ext_matrices: (C, 4, 4) lidar to camera transforms
+    :param centers: (K, 3) box centers
+    :param heights: (K,) box heights
+    :param rz: (K,) box yaw
+    :return: bottom centers in camera frame (C, K, 3), rotation_y (C, K), alpha (C, K)
+    """
+    ext_matrices = np.asarray(ext_matrices, dtype=np.float64).reshape(-1, 4, 4)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    rot, t = ext_matrices[:, :3, :3], ext_matrices[:, None, :3, 3]
+
+    heading = np.stack([np.cos(rz), np.sin(rz), np.zeros_like(rz)], axis=-1)
+    cam_heading = np.einsum('cij,kj->cki', rot, heading)
+    ry = -alpha_in_pi(np.arctan2(cam_heading[..., 2], cam_heading[..., 0]))
+
+    cam_center = np.einsum('cij,kj->cki', rot, centers) + t
+    alpha = ry - alpha_in_pi(np.arctan2(cam_center[..., 0], cam_center[..., 2]))
+
+    bottom = centers - np.stack([np.zeros_like(heights), np.zeros_like(heights), np.asarray(heights) / 2], axis=-1)
+    cam_bottom = np.einsum('cij,kj->cki', rot, bottom) + t
+
+    return cam_bottom, ry, alpha
+
+
 def count_points(
         pc: np.ndarray,
         cx: float,
@@ -112,6 +150,171 @@ def count_points(
     return len(pc[mask])
 
 
+def _expand_ranges(
+        starts: np.ndarray,
+        ends: np.ndarray
+) -> np.ndarray:
+    lengths = ends - starts
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+    return offsets + np.arange(lengths.sum())
+
+
+def _grid_candidates(
+        xyz: np.ndarray,
+        centers: np.ndarray,
+        extents: np.ndarray,
+        cell_size: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    # bucket points into xy cells, sorted by cell key
+    origin = xyz[:, :2].min(axis=0)
+    cells = np.floor((xyz[:, :2] - origin) / cell_size).astype(np.int64)
+    nx, ny = cells.max(axis=0) + 1
+    keys = cells[:, 0] * ny + cells[:, 1]
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    # cells under each box footprint, one contiguous key range per grid column
+    lo = np.floor((centers[:, :2] - extents[:, :2] - origin) / cell_size).astype(np.int64)
+    hi = np.floor((centers[:, :2] + extents[:, :2] - origin) / cell_size).astype(np.int64)
+    lo, hi = np.maximum(lo, 0), np.minimum(hi, [nx - 1, ny - 1])
+    n_cols = np.where(hi[:, 1] >= lo[:, 1], np.maximum(hi[:, 0] - lo[:, 0] + 1, 0), 0)
+    col_box = np.repeat(np.arange(len(centers)), n_cols)
+    col_i = lo[col_box, 0] + _expand_ranges(np.zeros_like(n_cols), n_cols)
+    starts = np.searchsorted(sorted_keys, col_i * ny + lo[col_box, 1], side='left')
+    ends = np.searchsorted(sorted_keys, col_i * ny + hi[col_box, 1], side='right')
+
+    return np.repeat(col_box, ends - starts), order[_expand_ranges(starts, ends)]
+
+
+def count_points_batch(
+        pc: np.ndarray,
+        boxes: np.ndarray,
+        return_indices: bool = False,
+        cell_size: Optional[float] = None,
+        chunk_size: int = 1 << 20,
+        index: Optional['PointIndex'] = None
+) -> Union[np.ndarray, Tuple[np.ndarray, List[np.ndarray]]]:
+    """
+    Count the points inside many 3D boxes at once.
+
+    Points are bucketed into a coarse xy grid, each box only gathers the cells under its
+    axis-aligned footprint and the oriented test of ``count_points`` runs on those candidates.
+
+    :param pc: (N, >=3) points
+    :param boxes: (K, 9) boxes as cx, cy, cz, dx, dy, dz, rx, ry, rz
+    :param return_indices: also return the point indices of every box
+    :param cell_size: grid cell size, defaults to the median box footprint
+    :param chunk_size: candidates tested at a time
+    :param index: a ``PointIndex`` over ``pc`` to gather candidates from instead of the grid
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 9)
+    n_boxes = len(boxes)
+    counts = np.zeros(n_boxes, dtype=np.int64)
+    if n_boxes == 0 or len(pc) == 0:
+        return (counts, [np.empty(0, dtype=np.int64) for _ in range(n_boxes)]) if return_indices else counts
+
+    xyz = pc[:, :3]
+    centers, half = boxes[:, :3], boxes[:, 3:6] / 2
+    rots = R.from_euler('XYZ', boxes[:, 6:]).as_matrix()
+
+    if index is not None:
+        cands = index.tree.query_ball_point(centers, np.linalg.norm(half, axis=1))
+        cand_box = np.repeat(np.arange(n_boxes), [len(c) for c in cands])
+        cand_pt = np.concatenate([np.asarray(c, dtype=np.int64) for c in cands])
+    else:
+        extents = np.einsum('kij,kj->ki', np.abs(rots), half)
+        if cell_size is None:
+            cell_size = max(float(np.median(extents[:, :2].max(axis=1))) * 2, 0.1)
+        cand_box, cand_pt = _grid_candidates(xyz, centers, extents, cell_size)
+
+    # oriented box test, same as count_points
+    inside = np.empty(len(cand_pt), dtype=bool)
+    for i in range(0, len(cand_pt), chunk_size):
+        b, p = cand_box[i:i + chunk_size], cand_pt[i:i + chunk_size]
+        local = np.einsum('nj,nji->ni', xyz[p] - centers[b], rots[b])
+        inside[i:i + chunk_size] = (np.abs(local) < half[b]).all(axis=1)
+
+    counts += np.bincount(cand_box[inside], minlength=n_boxes)
+    if not return_indices:
+        return counts
+
+    return counts, np.split(cand_pt[inside], np.cumsum(counts)[:-1])
+
+
+def segment_statistics(
+        xyz: np.ndarray,
+        labels: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Point count, xy distance and height range of every label in one pass.
+
+    Points are sorted by label once and every statistic is a ``reduceat`` over the label runs.
+
+    :param xyz: (N, >=3) points
+    :param labels: (N,) label of every point
+    :return: arrays keyed by "id" (sorted unique labels), "count", "min_distance",
+        "max_distance", "min_height" and "max_height"
+    """
+    labels = np.asarray(labels).ravel()
+    keys = ("min_distance", "max_distance", "min_height", "max_height")
+    if len(labels) == 0:
+        return {"id": labels, "count": np.zeros(0, dtype=np.int64), **{k: np.zeros(0) for k in keys}}
+
+    order = np.argsort(labels, kind='stable')
+    ids, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+
+    sorted_xyz = xyz[order, :3]
+    xy_norm = np.linalg.norm(sorted_xyz[:, :2], axis=1)
+    z = sorted_xyz[:, 2]
+
+    return {
+        "id": ids,
+        "count": counts,
+        "min_distance": np.minimum.reduceat(xy_norm, starts),
+        "max_distance": np.maximum.reduceat(xy_norm, starts),
+        "min_height": np.minimum.reduceat(z, starts),
+        "max_height": np.maximum.reduceat(z, starts)
+    }
+
+
+def remap_labels(
+        array: np.ndarray,
+        mapping: Dict,
+        default=0,
+        dtype=None,
+        dense_limit: int = 1 << 24
+) -> np.ndarray:
+    """
+    Map every label through ``mapping``; labels missing from it become ``default``.
+
+    Integer labels spanning at most ``dense_limit`` values go through a dense lookup table,
+    anything else through a binary search over the sorted keys.
+
+    :param dtype: output dtype, by default wide enough for every value of ``mapping`` and ``default``
+    """
+    array = np.asarray(array)
+    dtype = np.asarray([*mapping.values(), default]).dtype if dtype is None else np.dtype(dtype)
+    if array.size == 0 or not mapping:
+        return np.full(array.shape, default, dtype=dtype)
+
+    keys = np.array(list(mapping.keys()))
+    values = np.array(list(mapping.values()), dtype=dtype)
+
+    if array.dtype.kind in 'iu' and keys.dtype.kind in 'iu':
+        lo, hi = int(array.min()), int(array.max())
+        if hi - lo < dense_limit:
+            in_range = (keys >= lo) & (keys <= hi)
+            lut = np.full(hi - lo + 1, default, dtype=dtype)
+            lut[keys[in_range] - lo] = values[in_range]
+            return lut[array] if lo == 0 else lut[array.astype(np.int64) - lo]
+
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    pos = np.minimum(np.searchsorted(keys, array), len(keys) - 1)
+    return np.where(keys[pos] == array, values[pos], np.array(default, dtype=dtype))
+
+
 def get_pose(
         cx,
         cy,
@@ -126,6 +329,33 @@ def get_pose(
     )
 
 
+def pose_matrix(
+        config: Union[Dict, List, np.ndarray]
+) -> np.ndarray:
+    """
+    4x4 pose from a 16-value (or 4x4) matrix, or from a dict holding ``position`` (or ``translation``)
+    {x, y, z} and ``heading`` (or ``rotation``) as a quaternion {x, y, z, w} or XYZ euler angles {x, y, z}.
+    """
+    if not isinstance(config, dict):
+        return np.asarray(config, dtype=np.float64).reshape(4, 4)
+
+    for key in ('matrix', 'pose', 'transform'):
+        if key in config:
+            return pose_matrix(config[key])
+
+    t = config.get('position') or config.get('translation') or {}
+    r = config.get('heading') or config.get('rotation') or {}
+    if 'w' in r:
+        rot = R.from_quat([r['x'], r['y'], r['z'], r['w']])
+    else:
+        rot = R.from_euler('XYZ', [r.get(k, 0) for k in 'xyz'])
+
+    return transform_matrix(
+        t_vec=[t.get(k, 0) for k in 'xyz'],
+        rot_mat=rot.as_matrix()
+    )
+
+
 def get_corners(
         dx,
         dy,
@@ -156,30 +386,198 @@ def get_distance(
     return proj_area.distance(point_o), proj_area.hausdorff_distance(point_o)
 
 
+def get_corners_batch(
+        boxes: np.ndarray
+) -> np.ndarray:
+    """
+    :param boxes: (N, 9) boxes as cx, cy, cz, dx, dy, dz, rx, ry, rz
+    :return: (N, 8, 3) corners, in the same order as ``get_corners``
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 9)
+    signs = np.array(list(product([-0.5, 0.5], repeat=3)))
+    rots = R.from_euler('XYZ', boxes[:, 6:]).as_matrix()
+
+    return np.einsum('kij,kcj->kci', rots, signs * boxes[:, None, 3:6]) + boxes[:, None, :3]
+
+
+_corner_pairs = np.array([(i, j) for i in range(8) for j in range(i + 1, 8)])
+
+
+def get_distance_batch(
+        boxes: np.ndarray,
+        corners: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Closed-form ``get_distance`` for many boxes: the min and max xy distance between the
+    projected box and the origin.
+
+    The projection holds the origin iff the vertical line through it crosses the box, otherwise
+    the min distance is reached on one of the segments between two corners.
+
+    :param boxes: (N, 9) boxes as cx, cy, cz, dx, dy, dz, rx, ry, rz
+    :param corners: (N, 8, 3) corners of ``boxes`` if already computed
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 9)
+    if corners is None:
+        corners = get_corners_batch(boxes)
+    xy = corners[:, :, :2]
+
+    # vertical line through the origin, in box coordinates: a + t * b
+    rots = R.from_euler('XYZ', boxes[:, 6:]).as_matrix()
+    half = boxes[:, 3:6] / 2
+    a = np.einsum('kji,kj->ki', rots, -boxes[:, :3])
+    b = rots[:, 2, :]
+    parallel = np.abs(b) < 1e-12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1, t2 = (-half - a) / b, (half - a) / b
+    in_slab = np.abs(a) <= half
+    t_lo = np.where(parallel, np.where(in_slab, -np.inf, np.inf), np.minimum(t1, t2))
+    t_hi = np.where(parallel, np.where(in_slab, np.inf, -np.inf), np.maximum(t1, t2))
+    contains_o = t_lo.max(axis=1) <= t_hi.min(axis=1)
+
+    p, q = xy[:, _corner_pairs[:, 0]], xy[:, _corner_pairs[:, 1]]
+    d = q - p
+    dd = (d ** 2).sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(dd > 0, -(p * d).sum(axis=2) / dd, 0)
+    seg_dist = np.linalg.norm(p + np.clip(t, 0, 1)[..., None] * d, axis=2)
+
+    min_d = np.where(contains_o, 0.0, seg_dist.min(axis=1))
+    max_d = np.linalg.norm(xy, axis=2).max(axis=1)
+
+    return min_d, max_d
+
+
+class PointIndex:
+    """ KD-tree over x/y/z with range queries, returned indices are rows of the indexed points.
+    """
+
+    def __init__(self, xyz: np.ndarray, leafsize: int = 16):
+        self.xyz = np.ascontiguousarray(xyz[:, :3], dtype=np.float64)
+        self.tree = cKDTree(self.xyz, leafsize=leafsize)
+        self._leafsize = leafsize
+        self._tree_xy = None
+
+    def __len__(self):
+        return len(self.xyz)
+
+    @property
+    def tree_xy(self) -> cKDTree:
+        if self._tree_xy is None:
+            self._tree_xy = cKDTree(self.xyz[:, :2], leafsize=self._leafsize)
+        return self._tree_xy
+
+    @staticmethod
+    def _ball(tree, center, radius) -> np.ndarray:
+        if np.isinf(radius):
+            return np.arange(tree.n, dtype=np.int64)
+        return np.sort(np.asarray(tree.query_ball_point(center, radius), dtype=np.int64))
+
+    def query_radius(self, center, radius: float) -> np.ndarray:
+        return self._ball(self.tree, np.asarray(center, dtype=np.float64)[:3], radius)
+
+    def query_cylinder(
+            self,
+            center,
+            radius: float,
+            zmin: float = -np.inf,
+            zmax: float = np.inf,
+            inner_radius: float = 0
+    ) -> np.ndarray:
+        """ Points whose xy distance to ``center`` is in [inner_radius, radius] and z in [zmin, zmax].
+        """
+        center = np.asarray(center, dtype=np.float64)[:2]
+        idx = self._ball(self.tree_xy, center, radius)
+        z = self.xyz[idx, 2]
+        mask = (zmin <= z) & (z <= zmax)
+        if inner_radius > 0:
+            mask &= np.linalg.norm(self.xyz[idx, :2] - center, axis=1) >= inner_radius
+        return idx[mask]
+
+    def query_box(self, cx, cy, cz, dx, dy, dz, rx, ry, rz) -> np.ndarray:
+        return self.query_boxes([[cx, cy, cz, dx, dy, dz, rx, ry, rz]])[1][0]
+
+    def query_boxes(self, boxes: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray]]:
+        return count_points_batch(self.xyz, boxes, return_indices=True, index=self)
+
+
 class PointCloud:
-    def __init__(self, pcd_file, valid_points=True):
+    def __init__(self, pcd_file, valid_points=True, mmap=False, fields=None):
         self.metadata = None
         self.code = None
         self.invalid_points = 0
+        self._index = None
+        self._keep_index = True
+
+        # x, y, z are needed to validate points even if they are not requested
+        load_fields = fields
+        if fields is not None and valid_points:
+            load_fields = list(fields) + [f for f in ('x', 'y', 'z') if f not in fields]
 
         if pcd_file is not None:
             if isinstance(pcd_file, (str, Path)):
                 with open(pcd_file, 'rb') as f:
-                    self.data = self._load_from_file(f)
+                    self.data = self._load_from_file(f, mmap_path=pcd_file if mmap else None, fields=load_fields)
             else:
-                self.data = self._load_from_file(pcd_file)
+                self.data = self._load_from_file(pcd_file, fields=load_fields)
 
         if valid_points:
             self.validate_points()
+            if len(load_fields or ()) > len(fields or ()):
+                self.data = repack_fields(self.data[list(self._project_dtype(self.data.dtype, fields).names)])
+
+    @classmethod
+    def open(cls, pcd_file, mmap=False, valid_points=None, fields=None):
+        """ Load a PCD file, optionally memory-mapping its point data.
+
+        With ``mmap=True`` a ``DATA binary`` file is exposed as a read-only ``np.memmap``
+        structured array, so fields are only read from disk when they are touched.
+        Other encodings can not be mapped and are loaded as usual.
+        With ``fields`` only those columns are decoded; unknown names are ignored.
+
+        ``valid_points`` defaults to ``not mmap``: dropping invalid points copies the whole
+        array into memory as soon as one point is invalid, which defeats the mapping.
+        """
+        if valid_points is None:
+            valid_points = not mmap
+        return cls(pcd_file, valid_points=valid_points, mmap=mmap, fields=fields)
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._index = None
+
+    def build_index(self, leafsize=16):
+        """ Build (or reuse) a ``PointIndex`` over x/y/z.
+
+        The index is dropped whenever ``data`` is reassigned, and rebuilt when asked for another
+        ``leafsize``; in-place edits of ``data`` are not tracked. Clouds shared by ``PointCloudCache``
+        do not keep their index, a new one is built on every call.
+        """
+        if self._index is not None and self._index._leafsize == leafsize:
+            return self._index
+
+        index = PointIndex(self.numpy(fields=['x', 'y', 'z']), leafsize=leafsize)
+        if self._keep_index:
+            self._index = index
+        return index
 
     @property
     def fields(self):
         return self.data.dtype.names
 
-    def validate_points(self):
+    def valid_mask(self):
+        """ Points with finite, not all-zero x, y, z. """
         pc = self.numpy(fields=['x', 'y', 'z'])
-        mask = ~np.isnan(pc).any(axis=1) & (pc != 0).any(axis=1)
-        self.invalid_points = len(pc) - mask.sum()
+        return ~np.isnan(pc).any(axis=1) & (pc != 0).any(axis=1)
+
+    def validate_points(self):
+        mask = self.valid_mask()
+        self.invalid_points = len(mask) - mask.sum()
         if self.invalid_points > 0:
             self.data = self.data[mask]
 
@@ -228,6 +626,89 @@ class PointCloud:
         fields = self.normalized_fields(extra_fields)
         return repack_fields(self.data[fields])
 
+    def _with_data(self, data: np.ndarray) -> 'PointCloud':
+        pc = PointCloud(None, valid_points=False)
+        pc.metadata = self.metadata
+        pc.code = self.code
+        pc.data = data
+        return pc
+
+    def with_columns(self, columns: Dict[str, Union[np.ndarray, np.generic]]) -> 'PointCloud':
+        """ New cloud with ``columns`` appended (or replaced); see ``save_pcd_with_columns`` to stream instead. """
+        n = len(self.data)
+        columns = {k: np.broadcast_to(np.asarray(v), (n,)) for k, v in columns.items()}
+        base = self.data.dtype
+        dtype = np.dtype(
+            [(name, columns[name].dtype if name in columns else base[name]) for name in base.names] +
+            [(name, col.dtype) for name, col in columns.items() if name not in base.names]
+        )
+        data = np.empty(n, dtype=dtype)
+        for name in dtype.names:
+            data[name] = columns[name] if name in columns else self.data[name]
+        return self._with_data(data)
+
+    def crop(
+            self,
+            radius: Optional[Union[float, Tuple[float, float]]] = None,
+            height: Optional[Union[float, Tuple[float, float]]] = None
+    ) -> 'PointCloud':
+        """
+        New cloud keeping the points within an xy distance and a z range, bounds included.
+
+        :param radius: max distance, or (min, max)
+        :param height: max z, or (min, max)
+        """
+        mask = np.ones(len(self.data), dtype=bool)
+        if radius is not None:
+            rmin, rmax = radius if isinstance(radius, (tuple, list)) else (0, radius)
+            d2 = self.data['x'].astype(np.float64) ** 2 + self.data['y'].astype(np.float64) ** 2
+            mask &= (d2 >= rmin ** 2) & (d2 <= rmax ** 2)
+        if height is not None:
+            hmin, hmax = height if isinstance(height, (tuple, list)) else (-math.inf, height)
+            mask &= (self.data['z'] >= hmin) & (self.data['z'] <= hmax)
+
+        return self._with_data(self.data[mask])
+
+    def voxel_keys(self, size: float) -> np.ndarray:
+        """ One int64 key per point, equal for points in the same ``size`` voxel. """
+        cells = np.floor(self.numpy(fields=['x', 'y', 'z'], dtype=np.float64) / size).astype(np.int64)
+        if len(cells) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        cells -= cells.min(axis=0)
+        dims = cells.max(axis=0) + 1
+        # 用python int比较, 避免int64乘积溢出
+        if int(dims[0]) * int(dims[1]) * int(dims[2]) < (1 << 62):
+            return cells[:, 0] + dims[0] * (cells[:, 1] + dims[1] * cells[:, 2])
+        # grid too large to enumerate: fall back to ranking the distinct rows
+        return np.unique(cells, axis=0, return_inverse=True)[1].ravel()
+
+    def voxel_downsample(self, size: float, reduce: str = 'mean') -> 'PointCloud':
+        """
+        New cloud with one point per occupied ``size`` voxel, in order of first occurrence.
+
+        :param reduce: "first" keeps the first point of every voxel; "mean" averages the float
+            fields and keeps the first value of the others (labels, packed colors, ...)
+        """
+        if reduce not in ('mean', 'first'):
+            raise ValueError(f'invalid reduce: "{reduce}"')
+
+        _, first, inverse, counts = np.unique(
+            self.voxel_keys(size), return_index=True, return_inverse=True, return_counts=True
+        )
+        order = np.argsort(first)
+        data = self.data[first[order]]
+        if reduce == 'mean' and len(data):
+            data = np.array(data)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            groups = rank[inverse.ravel()]
+            for name in data.dtype.names:
+                if data.dtype[name].kind == 'f':
+                    data[name] = np.bincount(groups, weights=self.data[name], minlength=len(data)) / counts[order]
+
+        return self._with_data(data)
+
     @staticmethod
     def _build_dtype(metadata):
         fieldnames = []
@@ -301,81 +782,150 @@ class PointCloud:
             metadata['version'] = '.7'
         return metadata
 
+    @staticmethod
+    def _project_dtype(dtype, fields=None):
+        if fields is None:
+            return dtype
+        return np.dtype([(name, dtype[name]) for name in dtype.names if name in fields])
+
     @staticmethod
     def _parse_points_from_buf(buf, dtype):
         return np.frombuffer(buf, dtype=dtype)
 
-    def parse_binary_compressed_pc_data(self, f, dtype):
-        """ Parse lzf-compressed data.
-        """
+    @staticmethod
+    def _decompress_buf(f):
         fmt = 'II'
         compressed_size, uncompressed_size = struct.unpack(fmt, f.read(struct.calcsize(fmt)))
         compressed_data = f.read(compressed_size)
+        if uncompressed_size == 0:
+            return b''
 
         buf = lzf.decompress(compressed_data, uncompressed_size)
-        if len(buf) != uncompressed_size:
+        if buf is None or len(buf) != uncompressed_size:
             raise IOError('Error decompressing data')
+        return buf
+
+    @staticmethod
+    def _parse_columns_from_buf(buf, dtype):
+        """ Build a read-only view for every column of field-by-field packed data.
+        """
+        num_points = len(buf) // dtype.itemsize
+        columns = {}
+        offset = 0
+        for name in dtype.names:
+            dt = dtype[name]
+            columns[name] = np.frombuffer(buf, dtype=dt, count=num_points, offset=offset)
+            offset += dt.itemsize * num_points
+        return columns
+
+    def parse_binary_compressed_pc_data(self, f, dtype, as_columns=False, fields=None):
+        """ Parse lzf-compressed data.
+
+        :param as_columns: return a dict of zero-copy column views instead of a structured array
+        :param fields: only keep these columns
+        """
         # the data is stored field-by-field
-        # pc_data = self._parse_points_from_buf(buf, dtype)
-        num_points = uncompressed_size // dtype.itemsize
-        pc_data = np.zeros(num_points, dtype=dtype)
-        ix = 0
-        for dti in range(len(dtype)):
-            dt = dtype[dti]
-            bytes = dt.itemsize * num_points
-            column = np.fromstring(buf[ix:(ix + bytes)], dt)
-            pc_data[dtype.names[dti]] = column
-            ix += bytes
+        columns = self._parse_columns_from_buf(self._decompress_buf(f), dtype)
+        if fields is not None:
+            dtype = self._project_dtype(dtype, fields)
+            columns = {name: columns[name] for name in dtype.names}
+        if as_columns:
+            return columns
+
+        num_points = len(next(iter(columns.values()))) if columns else 0
+        pc_data = np.empty(num_points, dtype=dtype)
+        for name, column in columns.items():
+            pc_data[name] = column
         return pc_data
 
-    def _load_from_file(self, f):
+    def parse_ascii_pc_data(self, f, dtype, points, fields=None, chunk_size=1 << 22):
+        """ Parse ascii data block by block into a preallocated structured array.
+
+        Each block holds the complete lines of ``chunk_size`` bytes. Values are read
+        as float64 and cast per column, so packed ``rgb`` floats keep their bits.
+        """
+        out_dtype = self._project_dtype(dtype, fields)
+        usecols = [dtype.names.index(name) for name in out_dtype.names]
+        num_fields = len(dtype.names)
+        pc_data = np.empty(points, dtype=out_dtype)
+        if not usecols:
+            return pc_data
+
+        n = 0
+        rest = b''
+        while n < points:
+            chunk = f.read(chunk_size)
+            buf = rest + chunk
+            if chunk:
+                cut = buf.rfind(b'\n') + 1
+                buf, rest = buf[:cut], buf[cut:]
+
+            values = np.fromstring(buf, dtype=np.float64, sep=' ')
+            block = values[:len(values) // num_fields * num_fields].reshape(-1, num_fields)
+            m = min(len(block), points - n)
+            for i, name in zip(usecols, out_dtype.names):
+                pc_data[name][n:n + m] = block[:m, i]
+            n += m
+
+            if not chunk:
+                break
+
+        return pc_data[:n]
+
+    def _read_header(self, f):
         header = []
         for _ in range(11):
             ln = f.readline().decode("ascii").strip()
             header.append(ln)
             if ln.startswith('DATA'):
-                metadata = self.parse_header(header)
-                self.code = code = metadata['data']
-                dtype = self._build_dtype(metadata)
-                break
-        else:
-            raise ValueError("invalid file header")
+                self.metadata = metadata = self.parse_header(header)
+                self.code = metadata['data']
+                return metadata, self._build_dtype(metadata)
 
-        points = metadata['points']
-        if code == 'ascii':
-            if 'rgb' in dtype.names:
-                pc = np.genfromtxt(f, dtype=dtype, delimiter=' ')  # np.loadtxt is too slow
-            else:
-                num_fields = len(dtype.fields)
-                pc = np.fromstring(f.read(), dtype=np.float32, sep=' ', count=points * num_fields).reshape(-1,
-                                                                                                           num_fields)
-                pc = np.core.records.fromarrays([pc[:, i] for i in range(num_fields)], dtype=dtype)
+        raise ValueError("invalid file header")
 
-            # pc = np.genfromtxt(f, dtype=dtype, delimiter=' ')
-            # pc = np.fromfile(f, dtype=dtype, sep=' ', count=points) # error
+    def _load_from_file(self, f, mmap_path=None, fields=None):
+        metadata, dtype = self._read_header(f)
+        code = self.code
+        out_dtype = self._project_dtype(dtype, fields)
+
+        points = metadata['points']
+        if fields is not None and not out_dtype.names:
+            # none of the requested fields exist: one empty record per point, whatever the encoding
+            return np.empty(points, dtype=out_dtype)
+        if code == 'binary' and mmap_path is not None and points > 0:
+            pc = np.memmap(mmap_path, dtype=dtype, mode='r', offset=f.tell(), shape=(points,))
+            if fields is not None:
+                # a multi-field view keeps the unread columns on disk
+                pc = pc[list(out_dtype.names)]
+        elif code == 'ascii':
+            pc = self.parse_ascii_pc_data(f, dtype, points, fields=fields)
         elif code == 'binary':
             rowstep = points * dtype.itemsize
             buf = f.read(rowstep)
             pc = self._parse_points_from_buf(buf, dtype)
+            if fields is not None:
+                pc = repack_fields(pc[list(out_dtype.names)])
         elif code == 'binary_compressed':
-            pc = self.parse_binary_compressed_pc_data(f, dtype)
+            pc = self.parse_binary_compressed_pc_data(f, dtype, fields=fields)
         else:
             raise ValueError(f'invalid pcd DATA: "{code}"')
 
         return pc
 
     @staticmethod
-    def save_pcd(pc: np.ndarray, file):
+    def make_header(dtype: np.dtype, num_points: int, data: str = 'binary', pad: int = 0) -> bytes:
         """
-        :param structured ndarray
-        :param file: str for file object
+        :param dtype: structured dtype of the points
+        :param data: "binary" or "binary_compressed"
+        :param pad: width the point counts are padded to, so they can be patched in place
         """
-        f = open(file, 'wb') if isinstance(file, (str, Path)) else file
+        if data not in ('binary', 'binary_compressed'):
+            raise ValueError(f'invalid pcd DATA: "{data}"')
 
-        fields = pc.dtype.names
-        dtypes = [pc.dtype[f] for f in fields]
+        fields = dtype.names
+        dtypes = [dtype[f] for f in fields]
         num_fields = len(fields)
-        num_points = len(pc)
         headers = [
             '# .PCD v0.7 - Point Cloud Data file format',
             'VERSION 0.7',
@@ -383,15 +933,316 @@ class PointCloud:
             f'SIZE {" ".join([str(d.itemsize) for d in dtypes])}',
             f'TYPE {" ".join([d.kind.upper() for d in dtypes])}',
             f'COUNT {" ".join(["1"] * num_fields)}',
-            f'WIDTH {num_points}',
+            f'WIDTH {num_points:<{pad}}',
             'HEIGHT 1',
             'VIEWPOINT 0 0 0 1 0 0 0',
-            f'POINTS {num_points}',
-            'DATA binary'
+            f'POINTS {num_points:<{pad}}',
+            f'DATA {data}'
         ]
-        header = bytes('\n'.join(headers) + '\n', 'ascii')
-        f.write(header)
-        f.write(pc.tobytes())
+        return bytes('\n'.join(headers) + '\n', 'ascii')
+
+    @staticmethod
+    def compress_columns(columns: List[np.ndarray]) -> bytes:
+        """ Pack columns one after another and lzf-compress them, as ``binary_compressed`` stores them.
+        """
+        raw = b''.join(np.ascontiguousarray(c).tobytes() for c in columns)
+        # incompressible data grows by at most one byte every 32
+        compressed = lzf.compress(raw, len(raw) + len(raw) // 32 + 16) if raw else b''
+        return struct.pack('II', len(compressed), len(raw)) + compressed
+
+    @staticmethod
+    def save_pcd(pc: np.ndarray, file, data: str = 'binary'):
+        """
+        :param structured ndarray
+        :param file: str, Path or file object
+        :param data: "binary" or "binary_compressed"
+        """
+        header = PointCloud.make_header(pc.dtype, len(pc), data)
+        if data == 'binary_compressed':
+            body = PointCloud.compress_columns([pc[name] for name in pc.dtype.names])
+        else:
+            body = np.ascontiguousarray(repack_fields(pc)).data
+        PointCloud._write_to(file, header, body)
+
+    @staticmethod
+    def save_pcd_with_columns(
+            pc: np.ndarray,
+            columns: Dict[str, Union[np.ndarray, np.generic]],
+            file,
+            data: str = 'binary',
+            chunk_size: int = 1 << 18
+    ):
+        """
+        Save ``pc`` with ``columns`` appended (or replaced, if ``pc`` already has them) in one pass,
+        without materializing the merged cloud.
+
+        :param columns: (N,) arrays or scalars broadcast to every point
+        :param data: "binary" or "binary_compressed"
+        """
+        n = len(pc)
+        columns = {k: np.broadcast_to(np.asarray(v), (n,)) for k, v in columns.items()}
+        dtype = np.dtype(
+            [(name, columns[name].dtype if name in columns else pc.dtype[name]) for name in pc.dtype.names] +
+            [(name, col.dtype) for name, col in columns.items() if name not in pc.dtype.names]
+        )
+
+        def _column(name):
+            return columns[name] if name in columns else pc[name]
+
+        if data == 'binary_compressed':
+            PointCloud._write_to(
+                file,
+                PointCloud.make_header(dtype, n, data),
+                PointCloud.compress_columns([_column(name) for name in dtype.names])
+            )
+            return
+
+        with PCDWriter(file, dtype, data) as writer:
+            buf = np.empty(min(chunk_size, n), dtype=dtype)
+            for start in range(0, n, chunk_size):
+                stop = min(start + chunk_size, n)
+                chunk = buf[:stop - start]
+                for name in dtype.names:
+                    chunk[name] = _column(name)[start:stop]
+                writer.write(chunk)
+
+    @staticmethod
+    def _write_to(file, *blocks: bytes):
+        f = open(file, 'wb') if isinstance(file, (str, Path)) else file
+        try:
+            for block in blocks:
+                f.write(block)
+        finally:
+            if isinstance(file, (str, Path)):
+                f.close()
+
+
+class PCDWriter:
+    """ Write a PCD file chunk by chunk; WIDTH and POINTS are patched on close.
+
+    ``binary`` chunks go straight to the file. ``binary_compressed`` keeps one lzf
+    block for the whole cloud, so its chunks are buffered and compressed on close.
+
+    >>> with PCDWriter('out.pcd', dtype, data='binary') as w:
+    ...     for chunk in chunks:
+    ...         w.write(chunk)
+    """
+    _count_width = 20
+
+    def __init__(self, file, dtype: np.dtype, data: str = 'binary'):
+        self.dtype = repack_fields(np.dtype(dtype))
+        self.data = data
+        self.num_points = 0
+        self._chunks = []
+        self._header = PointCloud.make_header(self.dtype, 0, data, pad=self._count_width)
+
+        self._own_file = isinstance(file, (str, Path))
+        self._f = open(file, 'wb') if self._own_file else file
+        self._start = self._f.tell()
+        self._f.write(self._header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, pc: np.ndarray):
+        # 结构化数组按位置转换类型, 字段顺序不同时先按名字重排
+        if pc.dtype.names != self.dtype.names:
+            if set(pc.dtype.names or ()) != set(self.dtype.names):
+                raise ValueError(f"fields {pc.dtype.names} do not match the writer's {self.dtype.names}")
+            pc = pc[list(self.dtype.names)]
+        pc = repack_fields(pc).astype(self.dtype, copy=False)
+        if self.data == 'binary_compressed':
+            self._chunks.append(pc)
+        else:
+            self._f.write(pc.tobytes())
+        self.num_points += len(pc)
+
+    def close(self):
+        if self._f is None:
+            return
+        try:
+            if self.data == 'binary_compressed':
+                self._f.write(PointCloud.compress_columns([
+                    np.concatenate([c[name] for c in self._chunks]) if self._chunks else np.empty(0, self.dtype[name])
+                    for name in self.dtype.names
+                ]))
+                self._chunks = []
+
+            end = self._f.tell()
+            self._f.seek(self._start)
+            self._f.write(PointCloud.make_header(self.dtype, self.num_points, self.data, pad=self._count_width))
+            self._f.seek(end)
+        finally:
+            if self._own_file:
+                self._f.close()
+            self._f = None
+
+
+class FrameAggregator:
+    """ Sliding window over the latest ``window`` frames of a sequence, merged into one coordinate frame.
+
+    Every frame is pushed with its ego pose (frame to world). Merging moves the points of each frame
+    into the frame picked by ``reference`` with one 4x4 transform per frame and tags them with their
+    frame number, so memory stays bounded by the window.
+
+    >>> agg = FrameAggregator(window=5)
+    >>> for no, (points, pose) in enumerate(frames):
+    ...     agg.push(points, pose, no)
+    ...     agg.write(f'{no}.pcd')
+    """
+
+    def __init__(self, window: int = 5, frame_field: str = 'frame'):
+        self.window = window
+        self.frame_field = frame_field
+        self._frames = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def frame_numbers(self) -> List[int]:
+        return [no for no, _, _ in self._frames]
+
+    def push(self, points: np.ndarray, pose: Union[Dict, List, np.ndarray], frame_no: Optional[int] = None):
+        """
+        :param points: structured array with at least x, y, z
+        :param pose: ego pose of the frame, anything ``pose_matrix`` accepts
+        :param frame_no: defaults to the previous frame number plus one
+        """
+        if frame_no is None:
+            frame_no = self._frames[-1][0] + 1 if self._frames else 0
+        self._frames.append((frame_no, points, pose_matrix(pose)))
+
+    def transforms(self, reference: Optional[int] = -1) -> np.ndarray:
+        """
+        :param reference: position in the window of the target frame, or None for the world frame
+        :return: (n, 4, 4) transform of every frame in the window into the reference frame
+        """
+        poses = np.stack([pose for _, _, pose in self._frames])
+        if reference is None:
+            return poses
+        return np.linalg.inv(poses[reference]) @ poses
+
+    @property
+    def dtype(self) -> np.dtype:
+        """ Fields of the newest frame plus the frame number column. """
+        base = self._frames[-1][1].dtype
+        return np.dtype(
+            [(name, base[name]) for name in base.names if name != self.frame_field] +
+            [(self.frame_field, np.int32)]
+        )
+
+    def iter_frames(self, reference: Optional[int] = -1):
+        """ Yield every frame of the window, oldest first, already transformed and tagged. """
+        dtype = self.dtype
+        for (frame_no, points, _), trans in zip(self._frames, self.transforms(reference)):
+            out = np.zeros(len(points), dtype=dtype)
+            for name in dtype.names:
+                if name in points.dtype.names and name != self.frame_field:
+                    out[name] = points[name]
+
+            xyz = np.stack([points['x'], points['y'], points['z']], axis=-1).astype(np.float64)
+            xyz = xyz @ trans[:3, :3].T + trans[:3, 3]
+            out['x'], out['y'], out['z'] = xyz.T
+            out[self.frame_field] = frame_no
+            yield out
+
+    def merged(self, reference: Optional[int] = -1) -> np.ndarray:
+        if not self._frames:
+            raise ValueError('no frame in the window')
+        return np.concatenate(list(self.iter_frames(reference)))
+
+    def write(self, file, reference: Optional[int] = -1, data: str = 'binary'):
+        """ Write the merged window, streaming frame by frame. """
+        if not self._frames:
+            raise ValueError('no frame in the window')
+        if data == 'binary_compressed':
+            return PointCloud.save_pcd(self.merged(reference), file, data)
+
+        with PCDWriter(file, self.dtype, data) as writer:
+            for frame in self.iter_frames(reference):
+                writer.write(frame)
+
+
+class PointCloudCache:
+    """ Size-bounded LRU cache of decoded point clouds, shared across requests.
+
+    Entries are keyed by path, mtime and size, so a rewritten file is decoded again.
+    Cached clouds are read-only and shared between callers, and do not keep a ``build_index``
+    KD-tree, so ``max_bytes`` bounds all the memory they hold.
+    """
+
+    def __init__(self, max_bytes: int = 1 << 30):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    @staticmethod
+    def _key(pcd_file, valid_points, fields):
+        path = Path(pcd_file).resolve()
+        st = path.stat()
+        return str(path), st.st_mtime_ns, st.st_size, valid_points, None if fields is None else tuple(fields)
+
+    def get(self, pcd_file: Union[str, Path], valid_points: bool = True, fields: Optional[List] = None) -> PointCloud:
+        key = self._key(pcd_file, valid_points, fields)
+        with self._lock:
+            pc = self._items.get(key)
+            if pc is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return pc
+            self.misses += 1
+
+        # decode outside the lock, a memory map could change under a rewritten file
+        pc = PointCloud(pcd_file, valid_points=valid_points, fields=fields)
+        pc.data.flags.writeable = False
+        pc._keep_index = False
+        nbytes = pc.data.nbytes
+        if nbytes > self.max_bytes:
+            return pc
+
+        with self._lock:
+            # older versions of a rewritten file can not be hit again
+            for stale in [k for k in self._items if k[0] == key[0] and k[3:] == key[3:] and k != key]:
+                self._nbytes -= self._items.pop(stale).data.nbytes
+            if key not in self._items:
+                self._items[key] = pc
+                self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self._nbytes -= old.data.nbytes
+        return pc
+
+    def invalidate(self, pcd_file: Optional[Union[str, Path]] = None):
+        """ Drop every entry of ``pcd_file``, or the whole cache if it is None.
+        """
+        path = None if pcd_file is None else str(Path(pcd_file).resolve())
+        with self._lock:
+            for key in [k for k in self._items if path is None or k[0] == path]:
+                self._nbytes -= self._items.pop(key).data.nbytes
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "items": len(self._items),
+            "bytes": self._nbytes,
+            "max_bytes": self.max_bytes
+        }
+
 
-        if isinstance(file, str):
-            f.close()
+# 缓存上限可通过环境变量配置, 单位字节
+pcd_cache = PointCloudCache(max_bytes=int(os.environ.get('PCD_CACHE_MAX_BYTES', 1 << 30)))